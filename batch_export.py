@@ -0,0 +1,179 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PySide6.QtCore import QThread, Signal
+
+import export_manifest
+import instrumentation
+import export_pipeline
+import memory_scheduler
+import shared_stamps
+
+# 批量导出引擎 - 在后台线程中运行分阶段导出流水线或调度进程池，避免阻塞GUI线程
+
+# 导出引擎：pipeline为线程流水线（编解码释放GIL，读写与编解码重叠），
+# process为每张图片一个任务的进程池（水印合成等持有GIL的工作也能用满多核）
+ENGINES = ('pipeline', 'process')
+DEFAULT_ENGINE = 'pipeline'
+ENGINE_LABELS = {
+    'pipeline': '分阶段流水线',
+    'process': '多进程'
+}
+
+
+class BatchExportWorker(QThread):
+    """使用分阶段流水线或进程池并行导出图片，通过信号向GUI报告进度
+
+    指定output_dir时使用输出目录中的导出清单，跳过源文件和设置都没有变化的图片
+    """
+
+    # 已完成数量, 总数, 当前完成的源文件路径
+    progress = Signal(int, int, str)
+    # 源文件路径, 错误信息
+    file_failed = Signal(str, str)
+    # 成功数量, 失败数量, 跳过（未变化）数量, 是否被取消
+    finished_export = Signal(int, int, int, bool)
+
+    def __init__(self, jobs, output_dir=None, engine=DEFAULT_ENGINE, stage_workers=None, max_workers=None,
+                 ram_budget=None, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self.output_dir = output_dir
+        self.engine = engine
+        self.stage_workers = stage_workers  # 流水线各阶段线程数，None时使用默认值
+        self.max_workers = max_workers or os.cpu_count() or 1  # 进程池的进程数
+        self.ram_budget = ram_budget  # 同时处理的图片的内存上限，None时为物理内存的一半
+        self.pipeline = None
+        self.gate = None  # 进程池的内存准入
+        self.futures = []  # 已提交到进程池的任务
+        self.stage_stats = {}  # 流水线导出完成后各阶段的统计
+        self.report = instrumentation.BatchReport()  # 本批图片各处理阶段的累计耗时和各编码档位的输出大小
+        self._cancelled = False
+
+    def cancel(self):
+        """请求取消：未开始的任务会被丢弃，正在处理的任务完成后停止"""
+        self._cancelled = True
+        if self.pipeline is not None:
+            self.pipeline.cancel()
+        if self.gate is not None:
+            self.gate.cancel()
+        for future in list(self.futures):
+            future.cancel()
+
+    def run(self):
+        total = len(self.jobs)
+        succeeded = 0
+        failed = 0
+
+        # 对照导出清单筛选出需要导出的任务（同一份设置只计算一次哈希）
+        manifest = export_manifest.ExportManifest(self.output_dir) if self.output_dir else None
+        digests = {}
+        pending = []
+        for job in self.jobs:
+            if self._cancelled:
+                break
+            key = id(job['spec'])
+            if key not in digests:
+                digests[key] = export_manifest.settings_digest(job)
+            if manifest is None or not manifest.is_up_to_date(job, digests[key]):
+                pending.append(job)
+        skipped = total - len(pending) if not self._cancelled else 0
+        done = skipped
+        if skipped:
+            self.progress.emit(done, total, "")
+
+        if self._cancelled or not pending:
+            self.finished_export.emit(succeeded, failed, skipped, self._cancelled)
+            return
+
+        counts = {'succeeded': 0, 'failed': 0, 'done': done}
+        lock = threading.Lock()
+
+        def on_result(job, error, timings, content_digest):
+            # 流水线的写入线程和进程池的回调线程都会调用；job为提交前的原任务
+            with lock:
+                if error is None:
+                    try:
+                        output_bytes = os.path.getsize(job['output_path'])
+                        if manifest is not None:
+                            manifest.record(job, content_digest, digests[id(job['spec'])])
+                    except Exception as e:
+                        # 记录结果失败（如输出文件已被移走）按该图片导出失败处理，不丢失进度
+                        error = str(e)
+                if error is not None:
+                    self.report.add(timings)
+                    counts['failed'] += 1
+                    self.file_failed.emit(job['image_path'], error)
+                else:
+                    self.report.add(timings, output_bytes, job.get('profile'))
+                    counts['succeeded'] += 1
+                counts['done'] += 1
+                self.progress.emit(counts['done'], total, job['image_path'])
+
+        try:
+            if self.engine == 'process':
+                self._run_processes(pending, on_result)
+            else:
+                self._run_pipeline(pending, on_result)
+        finally:
+            if manifest is not None:
+                # 保存进度，下次导出从此处继续
+                manifest.save()
+        succeeded, failed = counts['succeeded'], counts['failed']
+
+        self.finished_export.emit(succeeded, failed, skipped, self._cancelled)
+
+    def _run_pipeline(self, pending, on_result):
+        # 读取、解码、水印、编码、写入分阶段并行，磁盘读写与编解码互相重叠
+        # 读取前按文件头估计内存占用准入，多张大图不会同时解码
+        self.pipeline = export_pipeline.ExportPipeline(self.stage_workers, on_result=on_result,
+                                                       ram_budget=self.ram_budget)
+        if self._cancelled:
+            self.pipeline.cancel()
+        self.stage_stats = self.pipeline.run(pending)
+
+    def _run_processes(self, pending, on_result):
+        # 任务数少于CPU数时不必启动多余的进程
+        workers = max(1, min(self.max_workers, len(pending)))
+        # 按估计的内存占用准入：任务完成后释放预留，下一张图片才提交到进程池
+        self.gate = memory_scheduler.MemoryGate(self.ram_budget or memory_scheduler.default_ram_budget())
+        if self._cancelled:
+            self.gate.cancel()
+
+        def on_done(future, job, reserved):
+            self.gate.release(reserved)
+            if future.cancelled():
+                return
+            try:
+                content_digest, timings = future.result()
+            except Exception as e:
+                on_result(job, str(e), {}, None)
+            else:
+                on_result(job, None, timings, content_digest)
+
+        # GUI进程中已有多个线程，fork可能复制到被其它线程持有的锁而导致子进程死锁，
+        # 因此统一使用spawn方式启动子进程（与Windows上的行为一致）；
+        # 水印图章在本进程中渲染一次并放入共享内存，子进程按句柄映射
+        with shared_stamps.StampPublisher() as publisher:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            try:
+                for job in pending:
+                    try:
+                        need = memory_scheduler.estimate_job_memory(job)
+                    except Exception:
+                        need = 0  # 无法读取文件头，子进程中会报告错误
+                    reserved = self.gate.acquire(need)
+                    if reserved is None or self._cancelled:
+                        break  # 已取消，丢弃尚未开始的任务
+                    # 提交带共享图章句柄的副本；结果按原任务报告（导出清单中的设置哈希按原规格查找）
+                    future = executor.submit(export_manifest.run_job, dict(job, spec=publisher.publish(job['spec'])))
+                    self.futures.append(future)
+                    future.add_done_callback(lambda f, job=job, reserved=reserved: on_done(f, job, reserved))
+                if self._cancelled:
+                    for future in self.futures:
+                        future.cancel()
+            finally:
+                # 取消时丢弃已提交但尚未开始的任务，等待正在处理的任务完成
+                executor.shutdown(wait=True, cancel_futures=self._cancelled)
@@ -0,0 +1,495 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import PIL
+from PIL import Image, ImageChops, ImageStat
+
+import font_registry
+import instrumentation
+import simple_watermark
+import stamp_cache
+import tiled_processing
+import watermark_core
+import watermark_spec
+from watermark_spec import WatermarkSpec
+
+# 水印引擎基准测试 - 生成合成测试图库（1-100MP；JPEG/PNG/TIFF；RGB/RGBA/L），
+# 对每种实现分阶段计时（解码、渲染、合成、编码），结果以JSON保存便于不同版本之间比较；
+# 每个用例的输出与参考输出逐像素比较，优化不会在不知不觉中改变输出
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "benchmark")
+RESULT_VERSION = 1
+
+DEFAULT_SIZES = [1, 12, 45, 100]  # 百万像素
+DEFAULT_FORMATS = ['JPEG', 'PNG', 'TIFF']
+DEFAULT_MODES = ['RGB', 'RGBA', 'L']
+ASPECT_RATIO = 3 / 2
+
+# 水印场景：纯文本、带阴影/描边/发光的文本、旋转的文本、图片水印
+SCENARIOS = ['text', 'text_effects', 'text_rotated', 'text_pattern', 'image']
+
+# 由场景之间的耗时差得到的阶段：特效 = text_effects - text，旋转 = text_rotated - text，
+# 平铺 = text_pattern - text
+DERIVED_STAGES = {'effects': 'text_effects', 'rotation': 'text_rotated', 'pattern': 'text_pattern'}
+
+JPEG_QUALITY = 95  # 与simple_watermark相同
+LOGO_SIZE = (512, 256)
+TILED_MEMORY_BUDGET = 16 * 1024 * 1024  # 分块实现使用的单张内存预算，足以触发分块处理
+NOISE_TILE = 256
+
+
+def _noise_tile(mode, seed):
+    """确定性的噪声图块（同一参数每次生成完全相同的像素，参考输出才能复用）"""
+    bands = len(Image.new(mode, (1, 1)).getbands())
+    data = hashlib.shake_256(f"{mode}-{seed}".encode()).digest(NOISE_TILE * NOISE_TILE * bands)
+    return Image.frombytes(mode, (NOISE_TILE, NOISE_TILE), data)
+
+
+def synthesize_image(megapixels, mode):
+    """生成合成测试图：分形 + 渐变作为大面积结构，叠加少量噪声模拟照片的细节和压缩难度"""
+    width = max(1, round((megapixels * 1_000_000 * ASPECT_RATIO) ** 0.5))
+    height = max(1, round(megapixels * 1_000_000 / width))
+    # 分形在四分之一分辨率计算后放大，100MP也只需几秒
+    small = (max(1, width // 2), max(1, height // 2))
+    fractal = Image.effect_mandelbrot(small, (-2.2, -1.2, 1.0, 1.2), 60).resize((width, height), Image.BICUBIC)
+    linear = Image.linear_gradient('L').resize((width, height))
+    radial = Image.radial_gradient('L').resize((width, height))
+    base = Image.merge('RGB', (fractal, linear, radial))
+
+    noise = Image.new('RGB', (width, height))
+    tile = _noise_tile('RGB', megapixels)
+    for y in range(0, height, NOISE_TILE):
+        for x in range(0, width, NOISE_TILE):
+            noise.paste(tile, (x, y))
+    img = Image.blend(base, noise, 0.12)
+    del base, noise
+
+    if mode == 'L':
+        return img.convert('L')
+    if mode == 'RGBA':
+        img.putalpha(ImageChops.invert(radial))  # 中心不透明、四周渐透明
+    return img
+
+
+def synthesize_logo():
+    """生成图片水印用的半透明徽标"""
+    logo = Image.new('RGBA', LOGO_SIZE, (0, 0, 0, 0))
+    fractal = Image.effect_mandelbrot(LOGO_SIZE, (-2.2, -1.2, 1.0, 1.2), 40)
+    logo.paste((255, 255, 255, 255), (0, 0), fractal)
+    return logo
+
+
+def build_corpus(corpus_dir, sizes, formats, modes):
+    """生成（或复用已生成的）测试图库，返回用例列表；JPEG不支持透明通道，跳过RGBA"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = []
+    for megapixels in sizes:
+        for mode in modes:
+            img = None
+            for fmt in formats:
+                if fmt == 'JPEG' and mode == 'RGBA':
+                    continue
+                name = f"{mode.lower()}_{megapixels:g}mp{watermark_core.OUTPUT_EXTENSIONS[fmt]}"
+                path = os.path.join(corpus_dir, name)
+                if not os.path.exists(path):
+                    if img is None:
+                        print(f"生成测试图: {megapixels:g}MP {mode}", file=sys.stderr)
+                        img = synthesize_image(megapixels, mode)
+                    tmp_path = path + ".tmp"
+                    # TIFF不压缩，分块实现可以逐行读取
+                    img.save(tmp_path, format=fmt, **({'quality': JPEG_QUALITY} if fmt == 'JPEG' else {}))
+                    os.replace(tmp_path, path)
+                corpus.append({'name': name, 'path': path, 'format': fmt, 'mode': mode,
+                               'megapixels': megapixels, 'digest': _file_digest(path)})
+            img = None
+
+    logo_path = os.path.join(corpus_dir, "logo.png")
+    if not os.path.exists(logo_path):
+        synthesize_logo().save(logo_path)
+    return corpus, logo_path
+
+
+def _file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def pixel_digest(path):
+    """解码后像素的哈希：编码参数不同但像素相同时哈希相同"""
+    with Image.open(path) as img:
+        img.load()
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{img.mode}{img.size}".encode())
+        h.update(img.tobytes())
+        return h.hexdigest()
+
+
+def scenario_settings(scenario, width, logo_path):
+    """场景对应的水印设置（键与GUI模板相同）；字号和徽标大小随图像宽度变化"""
+    settings = {
+        'type': 'text',
+        'text': '© Benchmark 2024 水印',
+        'font': 'Arial',
+        'font_size': max(12, width // 30),
+        'color': 'white',
+        'opacity': 80,
+        'position': 'bottom_right',
+        'rotation': 0,
+        'effects': {'shadow': False, 'outline': False, 'glow': False},
+        'image_path': '',
+        'image_scale': 100
+    }
+    if scenario == 'text_effects':
+        settings['effects'] = {'shadow': True, 'outline': True, 'glow': True, 'shadow_blur': 3}
+    elif scenario == 'text_rotated':
+        settings['rotation'] = 30
+    elif scenario == 'text_pattern':
+        settings['position'] = watermark_spec.PATTERN_POSITION
+        settings['rotation'] = 30
+        settings['pattern'] = {'spacing': max(10, width // 20), 'stagger': 50}
+    elif scenario == 'image':
+        settings['type'] = 'image'
+        settings['image_path'] = logo_path
+        settings['image_scale'] = max(1, round(width / 5 / LOGO_SIZE[0] * 100))
+    return settings
+
+
+def _clear_caches():
+    """清空图章和字体缓存，每次测量的都是首次渲染的耗时"""
+    watermark_core.measure_text.cache_clear()
+    stamp_cache.stamps.clear()
+    font_registry._load.cache_clear()
+
+
+def _lap(timings, stage, start):
+    now = time.perf_counter()
+    timings[stage] = now - start
+    return now
+
+
+def run_core(case, settings, output_path):
+    """GUI导出和命令行工具共用的渲染核心（watermark_core + WatermarkSpec）"""
+    spec = WatermarkSpec.compile(settings)  # 每批只编译一次，不计入单张耗时
+    timings = {}
+    start = time.perf_counter()
+    img = watermark_core.open_image(case['path'])
+    start = _lap(timings, 'decode', start)
+    placements = spec.placements(img.width, img.height)
+    start = _lap(timings, 'render', start)
+    for layer, x, y in placements:
+        watermark_core.composite_onto(img, layer, x, y)
+    start = _lap(timings, 'composite', start)
+    watermark_core.encode_image(img, output_path, case['format'], JPEG_QUALITY)
+    _lap(timings, 'encode', start)
+    return timings
+
+
+def run_simple(case, settings, output_path):
+    """simple_watermark：整个流程在一个函数中完成，各阶段耗时来自其中的instrumentation计时"""
+    opacity = round(settings['opacity'] * 255 / 100)
+    timings = {}
+    # 出错信息会打印到标准输出，由返回值判断是否成功
+    with contextlib.redirect_stdout(io.StringIO()), instrumentation.collect(timings):
+        start = time.perf_counter()
+        if settings['type'] == 'image':
+            ok = simple_watermark.apply_image_watermark(
+                case['path'], output_path, settings['image_path'], settings['position'],
+                opacity, settings['rotation'], settings['image_scale'] / 100, pattern=settings.get('pattern'))
+        else:
+            ok = simple_watermark.apply_text_watermark(
+                case['path'], output_path, settings['text'], settings['font_size'], settings['color'],
+                settings['position'], opacity, settings['rotation'], settings['effects'], settings['font'],
+                pattern=settings.get('pattern'))
+        elapsed = time.perf_counter() - start
+    if not ok:
+        raise RuntimeError("simple_watermark处理失败")
+    # 未计时的部分（测量文字、计算位置等）
+    timings['other'] = max(0.0, elapsed - sum(timings.values()))
+    return timings
+
+
+def run_tiled(case, settings, output_path):
+    """分块处理（tiled_processing）：按内存预算逐条带读写，只支持未压缩的TIFF/BMP"""
+    if case['format'] not in ('TIFF', 'BMP'):
+        return None
+    job = {'image_path': case['path'], 'output_path': output_path, 'spec': WatermarkSpec.compile(settings),
+           'output_format': case['format'], 'quality': JPEG_QUALITY}
+    start = time.perf_counter()
+    try:
+        tiled_processing.export_image_tiled(job, TILED_MEMORY_BUDGET)
+    except tiled_processing.TilingNotSupported:
+        return None
+    return {'total': time.perf_counter() - start}
+
+
+IMPLEMENTATIONS = {
+    'core': run_core,
+    'simple': run_simple,
+    'tiled': run_tiled
+}
+
+
+def compare_pixels(path, reference_path):
+    """逐像素比较输出与参考输出，返回(最大通道差, 平均通道差, 不同像素所在区域)"""
+    with Image.open(path) as a, Image.open(reference_path) as b:
+        if a.mode != b.mode or a.size != b.size:
+            return 255, 255.0, (0, 0) + a.size
+        diff = ImageChops.difference(a, b)
+    bbox = diff.getbbox(alpha_only=False)
+    if bbox is None:
+        return 0, 0.0, None
+    extrema = diff.getextrema()
+    if diff.mode in ('L', 'I', 'F'):
+        extrema = (extrema,)
+    max_diff = max(high for _, high in extrema)
+    mean_diff = sum(ImageStat.Stat(diff).mean) / len(diff.getbands())
+    return max_diff, mean_diff, bbox
+
+
+class PixelCheck:
+    """参考输出目录：首次运行（或要求更新时）保存输出作为参考，之后的运行与之逐像素比较"""
+
+    def __init__(self, reference_dir, tolerance=0, update=False):
+        self.reference_dir = reference_dir
+        self.tolerance = tolerance
+        self.update = update
+        self.failures = []
+
+    def check(self, key, case, output_path):
+        """返回检查结果字典；超出容差时记录失败"""
+        # 参考输出只对生成它的测试图有效
+        reference_path = os.path.join(self.reference_dir, key + os.path.splitext(output_path)[1])
+        meta_path = reference_path + ".json"
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+
+        if self.update or meta is None or meta.get('source') != case['digest'] or not os.path.exists(reference_path):
+            os.makedirs(self.reference_dir, exist_ok=True)
+            shutil.copyfile(output_path, reference_path)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'source': case['digest']}, f)
+            return {'status': 'reference_saved'}
+
+        max_diff, mean_diff, bbox = compare_pixels(output_path, reference_path)
+        result = {'status': 'ok' if max_diff <= self.tolerance else 'changed',
+                  'max_diff': max_diff, 'mean_diff': round(mean_diff, 4)}
+        if bbox is not None:
+            result['bbox'] = list(bbox)
+        if result['status'] == 'changed':
+            self.failures.append(key)
+        return result
+
+
+def run_benchmark(corpus, logo_path, implementations, scenarios, repeat, pixel_check, work_dir):
+    """运行所有用例，返回结果列表；每个用例重复repeat次，各阶段取中位数"""
+    results = []
+    for case in corpus:
+        with Image.open(case['path']) as img:
+            width = img.width
+        for scenario in scenarios:
+            settings = scenario_settings(scenario, width, logo_path)
+            for name in implementations:
+                run = IMPLEMENTATIONS[name]
+                key = f"{name}-{scenario}-{case['name'].replace('.', '_')}"
+                output_path = os.path.join(work_dir, key + watermark_core.OUTPUT_EXTENSIONS[case['format']])
+                samples = []
+                for _ in range(repeat):
+                    _clear_caches()
+                    timings = run(case, settings, output_path)
+                    if timings is None:
+                        break  # 该实现不支持此用例
+                    samples.append(timings)
+                if not samples:
+                    continue
+
+                stages = {stage: statistics.median(s.get(stage, 0.0) for s in samples) for stage in samples[0]}
+                result = {
+                    'implementation': name,
+                    'scenario': scenario,
+                    'image': case['name'],
+                    'format': case['format'],
+                    'mode': case['mode'],
+                    'megapixels': case['megapixels'],
+                    'source_digest': case['digest'],
+                    'stages': {stage: round(value, 5) for stage, value in stages.items()},
+                    'total': round(statistics.median(sum(s.values()) for s in samples), 5),
+                    'output_bytes': os.path.getsize(output_path),
+                    'output_digest': pixel_digest(output_path)
+                }
+                if pixel_check is not None:
+                    result['pixel_check'] = pixel_check.check(key, case, output_path)
+                os.remove(output_path)
+                results.append(result)
+                _print_result(result)
+    return results
+
+
+def derive_stages(results):
+    """由场景之间的耗时差得到特效和旋转的耗时
+
+    有单独渲染阶段的实现按渲染耗时相减，否则按总耗时相减（受编解码耗时波动影响较大）
+    """
+    totals = {(r['implementation'], r['image'], r['scenario']): r['stages'].get('render', r['total'])
+              for r in results}
+    derived = {}
+    for (name, image, scenario), total in totals.items():
+        if scenario != 'text':
+            continue
+        for stage, variant in DERIVED_STAGES.items():
+            if (name, image, variant) in totals:
+                derived.setdefault((name, image), {})[stage] = round(totals[(name, image, variant)] - total, 5)
+    return [{'implementation': name, 'image': image, 'stages': stages}
+            for (name, image), stages in derived.items()]
+
+
+def compare_results(results, baseline, budget=None):
+    """与之前保存的结果比较总耗时和输出像素，返回超出性能预算的用例列表"""
+    previous = {(r['implementation'], r['scenario'], r['image']): r for r in baseline['results']}
+    regressions = []
+    print("\n与基准结果比较:")
+    for r in results:
+        old = previous.get((r['implementation'], r['scenario'], r['image']))
+        if old is None or old['source_digest'] != r['source_digest'] or not old['total']:
+            continue
+        change = (r['total'] - old['total']) / old['total'] * 100
+        notes = []
+        if old['output_digest'] != r['output_digest']:
+            notes.append("输出像素已变化")
+        if budget is not None and change > budget:
+            notes.append(f"超出预算 {budget:g}%")
+            regressions.append(r)
+        print(f"  {r['implementation']:<7} {r['scenario']:<13} {r['image']:<18} "
+              f"{old['total']:.3f}s -> {r['total']:.3f}s ({change:+.1f}%) {' '.join(notes)}")
+    return regressions
+
+
+def _print_result(result):
+    stages = ", ".join(f"{stage} {value:.3f}s" for stage, value in result['stages'].items())
+    check = result.get('pixel_check', {})
+    status = check.get('status', '')
+    if status == 'changed':
+        status = f"像素变化 最大差 {check['max_diff']} 平均差 {check['mean_diff']}"
+    print(f"{result['implementation']:<7} {result['scenario']:<13} {result['image']:<18} "
+          f"{result['total']:.3f}s  [{stages}] {status}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='水印引擎基准测试：合成测试图库、分阶段计时、逐像素检查。')
+    parser.add_argument('--sizes', type=str, default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help='测试图尺寸（百万像素），逗号分隔，默认为 1,12,45,100。')
+    parser.add_argument('--formats', type=str, default=",".join(DEFAULT_FORMATS),
+                        help='测试图格式，默认为 JPEG,PNG,TIFF。')
+    parser.add_argument('--modes', type=str, default=",".join(DEFAULT_MODES),
+                        help='测试图色彩模式，默认为 RGB,RGBA,L。')
+    parser.add_argument('--implementations', type=str, default=",".join(IMPLEMENTATIONS),
+                        help='要测试的实现，默认为全部（core,simple,tiled）。')
+    parser.add_argument('--scenarios', type=str, default=",".join(SCENARIOS),
+                        help='要测试的水印场景，默认为全部。')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例的重复次数（取中位数），默认为 3。')
+    parser.add_argument('--corpus-dir', type=str, default=os.path.join(CACHE_DIR, "corpus"),
+                        help='测试图库目录，已生成的测试图会被复用。')
+    parser.add_argument('-o', '--output', type=str,
+                        help='结果JSON文件，默认为 cache/benchmark/results/<时间>.json。')
+    parser.add_argument('--compare', type=str, help='与之前保存的结果JSON比较。')
+    parser.add_argument('--budget', type=float,
+                        help='性能预算：与--compare的结果相比总耗时增加超过该百分比时返回失败。')
+    parser.add_argument('--reference-dir', type=str, default=os.path.join(CACHE_DIR, "reference"),
+                        help='参考输出目录，用于逐像素检查。')
+    parser.add_argument('--update-reference', action='store_true', help='用本次输出替换参考输出。')
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='逐像素检查允许的最大通道差，默认为 0（完全相同）。')
+    parser.add_argument('--no-pixel-check', action='store_true', help='不进行逐像素检查。')
+    return parser.parse_args(argv)
+
+
+def _split(value, choices, what):
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    unknown = [item for item in items if item not in choices]
+    if unknown:
+        raise ValueError(f"未知的{what}: {', '.join(unknown)}（可选: {', '.join(choices)}）")
+    return items
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        sizes = [float(s) for s in args.sizes.split(',') if s.strip()]
+        formats = _split(args.formats, DEFAULT_FORMATS, "格式")
+        modes = _split(args.modes, DEFAULT_MODES, "色彩模式")
+        implementations = _split(args.implementations, list(IMPLEMENTATIONS), "实现")
+        scenarios = _split(args.scenarios, SCENARIOS, "场景")
+        baseline = None
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    if any(s <= 0 for s in sizes) or args.repeat < 1:
+        print("错误: 尺寸和重复次数必须大于0", file=sys.stderr)
+        return 2
+
+    # 超大测试图不是解压炸弹
+    Image.MAX_IMAGE_PIXELS = None
+    instrumentation.set_level(instrumentation.TIMING)
+    corpus, logo_path = build_corpus(args.corpus_dir, sizes, formats, modes)
+    pixel_check = None if args.no_pixel_check else PixelCheck(args.reference_dir, args.tolerance,
+                                                              args.update_reference)
+
+    with tempfile.TemporaryDirectory(prefix="wm_bench_") as work_dir:
+        results = run_benchmark(corpus, logo_path, implementations, scenarios, args.repeat, pixel_check, work_dir)
+
+    derived = derive_stages(results)
+    if derived:
+        print("\n由场景差得到的阶段耗时:")
+        for item in derived:
+            stages = ", ".join(f"{stage} {value:+.3f}s" for stage, value in item['stages'].items())
+            print(f"  {item['implementation']:<7} {item['image']:<18} {stages}")
+
+    output = args.output or os.path.join(CACHE_DIR, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': RESULT_VERSION,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'environment': {
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count()
+            },
+            'repeat': args.repeat,
+            'results': results,
+            'derived': derived
+        }, f, ensure_ascii=False, indent=1)
+    print(f"\n结果已保存到: {output}")
+
+    failed = False
+    if baseline is not None:
+        regressions = compare_results(results, baseline, args.budget)
+        if regressions:
+            print(f"{len(regressions)} 个用例超出性能预算", file=sys.stderr)
+            failed = True
+    if pixel_check is not None and pixel_check.failures:
+        print(f"{len(pixel_check.failures)} 个用例的输出与参考输出不同: {', '.join(pixel_check.failures)}",
+              file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import os
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import user_cache
+
+# EXIF快速索引 - 只读取JPEG的APP1段、PNG的eXIf块或TIFF的IFD，不解码像素；
+# 读取结果按(路径, 大小, 修改时间)持久化，再次处理同一批照片时无需重新读取
+
+# 默认索引文件位置（与缩略图缓存放在同一个用户缓存目录下）
+INDEX_PATH = user_cache.cache_dir("exif_index.json")
+INDEX_VERSION = 1
+
+# 索引中最多保留的条目数，超出时删除最早建立的条目
+MAX_INDEX_ENTRIES = 100000
+
+# 需要读取的标签
+TAG_NAMES = {
+    0x010F: 'Make',
+    0x0110: 'Model',
+    0x0112: 'Orientation',
+    0x0132: 'DateTime',
+    0x9003: 'DateTimeOriginal',
+    0x9004: 'DateTimeDigitized',
+}
+
+# Exif子IFD指针
+EXIF_IFD_POINTER = 0x8769
+
+# TIFF数据类型 -> 单个值的字节数（只解析ASCII/BYTE/SHORT/LONG/UNDEFINED）
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 7: 1}
+
+# 单个IFD的最大条目数，超出视为数据损坏
+MAX_IFD_ENTRIES = 1000
+
+# 单个标签值的最大字节数：需要的标签都是短字符串或整数，更大的值视为数据损坏，不读取
+MAX_VALUE_SIZE = 4096
+
+
+def _parse_ifd(read, size, offset, endian, tags, follow_exif):
+    """解析一个IFD；条目数和各偏移在读取前先与数据大小size比较，越界的IFD或标签值直接跳过"""
+    if offset + 2 > size:
+        return
+    count_data = read(offset, 2)
+    if len(count_data) < 2:
+        return
+    count = struct.unpack(endian + 'H', count_data)[0]
+    if count > MAX_IFD_ENTRIES or offset + 2 + 12 * count > size:
+        return
+    entries = read(offset + 2, 12 * count)
+
+    for i in range(len(entries) // 12):
+        tag, typ, n, value = struct.unpack(endian + 'HHI4s', entries[i * 12:(i + 1) * 12])
+        if tag == EXIF_IFD_POINTER and follow_exif:
+            _parse_ifd(read, size, struct.unpack(endian + 'I', value)[0], endian, tags, False)
+            continue
+        name = TAG_NAMES.get(tag)
+        if name is None or typ not in TYPE_SIZES or n == 0:
+            continue
+        total = TYPE_SIZES[typ] * n
+        # 不超过4字节的值直接存放在条目中，否则条目中是数据偏移
+        if total <= 4:
+            data = value[:total]
+        else:
+            value_offset = struct.unpack(endian + 'I', value)[0]
+            if total > MAX_VALUE_SIZE or value_offset + total > size:
+                continue
+            data = read(value_offset, total)
+        if typ == 2:
+            tags[name] = data.split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+        elif typ == 3 and len(data) >= 2:
+            tags[name] = struct.unpack(endian + 'H', data[:2])[0]
+        elif typ == 4 and len(data) >= 4:
+            tags[name] = struct.unpack(endian + 'I', data[:4])[0]
+
+
+def parse_tiff_tags(read, size):
+    """解析TIFF结构（EXIF数据本身也是TIFF结构）中的标签
+
+    read(offset, size)返回相对TIFF头的数据，size为数据的总字节数
+    """
+    header = read(0, 8)
+    if len(header) < 8:
+        return {}
+    if header[:2] == b'II':
+        endian = '<'
+    elif header[:2] == b'MM':
+        endian = '>'
+    else:
+        return {}
+    magic, ifd_offset = struct.unpack(endian + 'HI', header[2:8])
+    if magic != 42:
+        return {}
+    tags = {}
+    _parse_ifd(read, size, ifd_offset, endian, tags, True)
+    return tags
+
+
+def _buffer_reader(data):
+    return lambda offset, size: data[offset:offset + size]
+
+
+def _file_reader(f, base=0):
+    def read(offset, size):
+        f.seek(base + offset)
+        return f.read(size)
+    return read
+
+
+def _find_jpeg_exif(f):
+    """在JPEG文件中查找Exif APP1段，遇到图像数据（SOS）即停止"""
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:  # 填充字节
+            byte = f.read(1)
+            if not byte:
+                return None
+            code = byte[0]
+        if code in (0xD9, 0xDA):  # EOI / SOS
+            return None
+        if 0xD0 <= code <= 0xD7 or code == 0x01:  # 无长度的标记
+            continue
+        length_data = f.read(2)
+        if len(length_data) < 2:
+            return None
+        length = struct.unpack('>H', length_data)[0]
+        if length < 2:
+            return None
+        if code == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(b'Exif\0\0'):
+                return data[6:]
+        else:
+            f.seek(length - 2, 1)
+
+
+def _find_png_exif(f, file_size):
+    """在PNG文件中查找eXIf块，遇到图像数据（IDAT）即停止"""
+    if f.read(8) != b'\x89PNG\r\n\x1a\n':
+        return None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack('>I4s', header)
+        if length > file_size - f.tell():
+            return None  # 块长度超出文件，数据损坏
+        if chunk_type == b'eXIf':
+            return f.read(length)
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        f.seek(length + 4, 1)  # 跳过数据和CRC
+
+
+def read_exif_tags(image_path):
+    """只读取文件头部的元数据，返回{标签名: 值}；没有EXIF时返回空字典"""
+    with open(image_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        head = f.read(8)
+        f.seek(0)
+        if head.startswith(b'\xff\xd8'):
+            data = _find_jpeg_exif(f)
+        elif head.startswith(b'\x89PNG'):
+            data = _find_png_exif(f, file_size)
+        elif head[:4] in (b'II*\x00', b'MM\x00*'):
+            # TIFF文件的标签就在文件本身的IFD中，按需读取
+            return parse_tiff_tags(_file_reader(f), file_size)
+        else:
+            return {}
+    if not data:
+        return {}
+    return parse_tiff_tags(_buffer_reader(data), len(data))
+
+
+def capture_date(tags):
+    """从标签中取拍摄日期（YYYY-MM-DD），依次尝试原始拍摄时间、数字化时间"""
+    for name in ('DateTimeOriginal', 'DateTimeDigitized'):
+        value = tags.get(name)
+        if value and len(value) >= 10:
+            return value.split(' ')[0].replace(':', '-')
+    return None
+
+
+class ExifIndex:
+    """持久化的EXIF索引：绝对路径 -> (大小, 修改时间, 标签)"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.entries = {}
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            pass  # 没有索引或索引损坏时重新建立
+
+    def _lookup_cached(self, key, stat):
+        entry = self.entries.get(key)
+        try:
+            if entry is not None and entry['stat'] == [stat.st_size, stat.st_mtime_ns]:
+                return entry['tags']
+        except (KeyError, TypeError):
+            pass  # 条目格式损坏时重新读取
+        return None
+
+    def _read(self, key):
+        """读取单个文件（在线程池中运行），返回(键, 文件状态, 标签)"""
+        stat = os.stat(key)
+        try:
+            tags = read_exif_tags(key)
+        except (OSError, struct.error, ValueError):
+            tags = {}
+        return key, stat, tags
+
+    def get_tags(self, image_paths, max_workers=None):
+        """返回{路径: 标签}；索引中没有或文件已变化的图片在线程池中并行读取"""
+        results = {}
+        missing = []
+        for path in image_paths:
+            key = os.path.abspath(path)
+            try:
+                tags = self._lookup_cached(key, os.stat(key))
+            except OSError:
+                results[path] = {}
+                continue
+            if tags is None:
+                missing.append((path, key))
+            else:
+                results[path] = tags
+
+        if missing:
+            workers = max_workers or min(16, (os.cpu_count() or 1) * 2)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for (path, _), future in zip(missing, [executor.submit(self._read, key) for _, key in missing]):
+                    try:
+                        key, stat, tags = future.result()
+                    except Exception:
+                        # 无法读取的文件（包括解析中的意外错误）按没有EXIF处理，不写入索引，下次重新读取
+                        results[path] = {}
+                        continue
+                    self.entries.pop(key, None)  # 重新读取的条目移到末尾，清理时最后删除
+                    self.entries[key] = {'stat': [stat.st_size, stat.st_mtime_ns], 'tags': tags}
+                    results[path] = tags
+            self._dirty = True
+        return results
+
+    def get_dates(self, image_paths, max_workers=None):
+        """返回{路径: 拍摄日期或None}"""
+        return {path: capture_date(tags) for path, tags in self.get_tags(image_paths, max_workers).items()}
+
+    def prune(self):
+        """删除已不存在的文件的条目，条目数超出MAX_INDEX_ENTRIES时删除最早建立的条目"""
+        entries = {key: entry for key, entry in self.entries.items() if os.path.exists(key)}
+        if len(entries) > MAX_INDEX_ENTRIES:
+            entries = dict(list(entries.items())[-MAX_INDEX_ENTRIES:])
+        if len(entries) != len(self.entries):
+            self.entries = entries
+            self._dirty = True
+
+    def save(self):
+        """清理后原子地写入索引（先写临时文件再替换）"""
+        if not self._dirty:
+            return
+        self.prune()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import hashlib
+
+import watermark_core
+
+# 增量导出清单 - 在输出目录中记录每个输出文件对应的源文件内容哈希和水印/导出设置哈希，
+# 再次导出时跳过没有变化的图片；清单随导出进度定期保存，中断后重新导出即可从断点继续
+
+MANIFEST_NAME = ".watermark_manifest.json"
+MANIFEST_VERSION = 1
+
+# 清单保存间隔：每完成若干张或经过若干秒保存一次
+SAVE_EVERY = 100
+SAVE_INTERVAL = 2.0
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """计算文件内容哈希"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_digest(job):
+    """计算水印规格和导出参数的哈希；图片水印的文件变化也会改变哈希（规格中记录了水印文件状态）"""
+    key = {
+        'spec': job['spec'].digest(),
+        'output_format': job['output_format'],
+        'quality': job.get('quality'),
+        'resize': job.get('resize'),
+        'profile': job.get('profile') or watermark_core.DEFAULT_PROFILE
+    }
+    data = json.dumps(key, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=20).hexdigest()
+
+
+def export_job(job, timings=None):
+    """导出单张图片并返回源文件内容哈希（在子进程中运行，解码刚读过的文件时哈希几乎只需计算时间）"""
+    watermark_core.export_image(job, timings)
+    start = time.perf_counter()
+    digest = file_digest(job['image_path'])
+    if timings is not None:
+        timings['hash'] = timings.get('hash', 0.0) + time.perf_counter() - start
+    return job['output_path'], digest
+
+
+def run_job(job):
+    """在进程池的子进程中导出单张图片，返回(源文件内容哈希, 各阶段耗时)"""
+    timings = {}
+    os.makedirs(os.path.dirname(job['output_path']) or '.', exist_ok=True)
+    _, digest = export_job(job, timings)
+    return digest, timings
+
+
+class ExportManifest:
+    """输出目录中的导出清单：输出文件相对路径 -> 源文件和设置的指纹"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            pass  # 没有清单或清单损坏时全部重新导出
+
+    def _key(self, output_path):
+        return os.path.relpath(output_path, self.output_dir).replace(os.sep, '/')
+
+    def is_up_to_date(self, job, job_settings_digest=None):
+        """输出文件存在且源文件内容、设置都没有变化时返回True"""
+        entry = self.entries.get(self._key(job['output_path']))
+        if entry is None:
+            return False
+        if entry['settings'] != (job_settings_digest or settings_digest(job)):
+            return False
+        try:
+            out_stat = os.stat(job['output_path'])
+            src_stat = os.stat(job['image_path'])
+        except OSError:
+            return False
+        # 输出文件被删除或修改过则重新导出
+        if [out_stat.st_size, out_stat.st_mtime_ns] != entry['output_stat']:
+            return False
+        if [src_stat.st_size, src_stat.st_mtime_ns] == entry['source_stat']:
+            return True
+        # 修改时间变化但内容可能未变（如复制、touch），比较内容哈希
+        if src_stat.st_size != entry['source_stat'][0] or file_digest(job['image_path']) != entry['source']:
+            return False
+        entry['source_stat'] = [src_stat.st_size, src_stat.st_mtime_ns]
+        return True
+
+    def record(self, job, content_digest, job_settings_digest=None):
+        """记录一张成功导出的图片，并按间隔保存清单"""
+        src_stat = os.stat(job['image_path'])
+        out_stat = os.stat(job['output_path'])
+        self.entries[self._key(job['output_path'])] = {
+            'source': content_digest,
+            'source_stat': [src_stat.st_size, src_stat.st_mtime_ns],
+            'settings': job_settings_digest or settings_digest(job),
+            'output_stat': [out_stat.st_size, out_stat.st_mtime_ns]
+        }
+        self._unsaved += 1
+        if self._unsaved >= SAVE_EVERY or time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """原子地写入清单（先写临时文件再替换）"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+        self._last_save = time.monotonic()
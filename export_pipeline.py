@@ -0,0 +1,279 @@
+import io
+import os
+import sys
+import time
+import queue
+import hashlib
+import threading
+
+import instrumentation
+import watermark_core
+from export_manifest import file_digest
+from memory_scheduler import MemoryGate, default_ram_budget, estimate_job_memory
+
+# 流水线导出引擎 - 读取、解码、水印、编码、写入五个阶段各有独立的线程数，
+# 阶段之间用有界队列连接：Pillow编解码时会释放GIL，磁盘/网络读写可以与CPU运算重叠，
+# 有界队列限制了同时驻留内存的图像数量，读取前再按估计的内存占用准入；
+# 每个阶段统计忙碌、等待输入和等待输出的时间
+
+STAGES = ('read', 'decode', 'watermark', 'encode', 'write')
+
+
+def default_stage_workers():
+    """各阶段默认线程数：I/O阶段固定少量线程，编解码阶段与CPU核数相同"""
+    cpus = os.cpu_count() or 1
+    return {
+        'read': 2,
+        'decode': cpus,
+        'watermark': max(1, cpus // 2),
+        'encode': cpus,
+        'write': 2
+    }
+
+
+# 队列中结束信号
+_DONE = object()
+
+
+class _Task:
+    """在各阶段之间传递的单张图片的处理状态"""
+
+    __slots__ = ('job', 'data', 'image', 'digest', 'timings', 'error', 'exported', 'reserved')
+
+    def __init__(self, job):
+        self.job = job
+        self.reserved = 0  # 准入时预留的内存（字节）
+        self.data = None  # 源文件内容或编码后的数据
+        self.image = None
+        self.digest = None  # 源文件内容哈希
+        self.timings = {}
+        self.error = None
+        self.exported = False  # 已通过分块处理直接导出
+
+
+class StageStats:
+    """单个阶段的统计：处理数量、忙碌时间、等待输入时间、等待下游时间、等待内存准入时间"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.throttled = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy, starved, blocked, throttled=0.0):
+        with self._lock:
+            self.items += 1
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.throttled += throttled
+
+    def utilisation(self, elapsed):
+        """阶段线程的平均忙碌比例（0-1），接近1说明该阶段是瓶颈"""
+        if elapsed <= 0:
+            return 0.0
+        return min(1.0, self.busy / (self.workers * elapsed))
+
+    def as_dict(self, elapsed):
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'busy': round(self.busy, 4),
+            'starved': round(self.starved, 4),
+            'blocked': round(self.blocked, 4),
+            'throttled': round(self.throttled, 4),
+            'utilisation': round(self.utilisation(elapsed), 3)
+        }
+
+
+def _read(task):
+    job = task.job
+    os.makedirs(os.path.dirname(job['output_path']) or '.', exist_ok=True)  # 分块处理直接写出输出文件
+    if watermark_core.export_tiled(job, task.timings):
+        # 超大图像已在分块处理中流式导出
+        task.exported = True
+        task.digest = file_digest(job['image_path'])
+        return
+    with open(job['image_path'], 'rb') as f:
+        task.data = f.read()
+    task.digest = hashlib.blake2b(task.data, digest_size=20).hexdigest()
+
+
+def _decode(task):
+    task.image = watermark_core.open_image(io.BytesIO(task.data), task.job.get('resize'))
+    task.data = None
+
+
+def _watermark(task):
+    task.job['spec'].apply(task.image)
+
+
+def _encode(task):
+    buffer = io.BytesIO()
+    watermark_core.encode_image(task.image, buffer, task.job['output_format'], task.job['quality'],
+                                task.job.get('profile'))
+    task.data = buffer.getvalue()
+    task.image = None
+
+
+def _write(task):
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(task.data)
+    os.makedirs(os.path.dirname(task.job['output_path']) or '.', exist_ok=True)
+    watermark_core.write_atomic(task.job['output_path'], write)
+    task.data = None
+
+
+_STAGE_FUNCTIONS = {
+    'read': _read,
+    'decode': _decode,
+    'watermark': _watermark,
+    'encode': _encode,
+    'write': _write
+}
+
+
+class ExportPipeline:
+    """分阶段导出一批任务（job格式与watermark_core.export_image相同）
+
+    on_result(job, 错误信息或None, 各阶段耗时, 源文件内容哈希)在工作线程中被串行调用；
+    ram_budget为同时处理的任务估计内存之和的上限（字节），None时为物理内存的一半
+    """
+
+    def __init__(self, stage_workers=None, queue_size=None, on_result=None, ram_budget=None):
+        self.stage_workers = default_stage_workers()
+        if stage_workers:
+            self.stage_workers.update({k: max(1, int(v)) for k, v in stage_workers.items()})
+        # 每个队列的容量：足够让下游线程都有活可做，同时限制内存中的图像数量
+        self.queue_size = queue_size
+        self.on_result = on_result
+        self.stats = {name: StageStats(name, self.stage_workers[name]) for name in STAGES}
+        self.elapsed = 0.0
+        self.gate = MemoryGate(ram_budget or default_ram_budget())
+        self._cancelled = threading.Event()
+        self._result_lock = threading.Lock()
+
+    def cancel(self):
+        """请求取消：尚未读取的任务被丢弃，已在流水线中的任务处理完毕"""
+        self._cancelled.set()
+        self.gate.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _admit(self, task):
+        """按估计的内存占用等待准入，返回等待时间；已取消时返回None"""
+        try:
+            need = estimate_job_memory(task.job)
+        except Exception:
+            need = 0  # 无法读取文件头，读取阶段会报告错误
+        start = time.perf_counter()
+        reserved = self.gate.acquire(need)
+        if reserved is None:
+            return None
+        task.reserved = reserved
+        return time.perf_counter() - start
+
+    def _finish(self, task):
+        self.gate.release(task.reserved)
+        task.reserved = 0
+        if self.on_result is not None:
+            try:
+                with self._result_lock:
+                    self.on_result(task.job, task.error, task.timings, task.digest)
+            except Exception as e:
+                # 回调出错不能让工作线程退出，否则run()会一直等待
+                print(f"Error reporting result for {task.job.get('image_path')}: {e}", file=sys.stderr)
+
+    def _stage_loop(self, name, inbox, outbox, remaining):
+        func = _STAGE_FUNCTIONS[name]
+        stats = self.stats[name]
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                task = inbox.get()
+                starved = time.perf_counter() - wait_start
+                if task is _DONE:
+                    break
+                throttled = 0.0
+                if name == STAGES[0]:
+                    # 取消后丢弃尚未读取的任务，已读取的任务继续处理完毕
+                    throttled = None if self.cancelled else self._admit(task)
+                    if throttled is None:
+                        continue
+
+                start = time.perf_counter()
+                if task.error is None and not task.exported:
+                    try:
+                        with instrumentation.collect(task.timings):
+                            func(task)
+                    except Exception as e:
+                        task.error = str(e)
+                        task.data = task.image = None
+                busy = time.perf_counter() - start
+                if busy and task.error is None and not task.exported:
+                    task.timings[name] = task.timings.get(name, 0.0) + busy
+
+                blocked_start = time.perf_counter()
+                if outbox is None:
+                    self._finish(task)
+                    blocked = 0.0
+                else:
+                    outbox.put(task)
+                    blocked = time.perf_counter() - blocked_start
+                stats.add(busy, starved, blocked, throttled)
+        finally:
+            # 无论线程如何退出都要通知下游，否则run()会一直等待
+            self._stage_done(outbox, remaining)
+
+    def _stage_done(self, outbox, remaining):
+        # 本阶段最后一个退出的线程通知下游阶段结束
+        with remaining['lock']:
+            remaining['count'] -= 1
+            last = remaining['count'] == 0
+        if last and outbox is not None:
+            for _ in range(remaining['downstream']):
+                outbox.put(_DONE)
+
+    def run(self, jobs):
+        """处理所有任务直到完成或被取消，返回各阶段统计"""
+        start = time.perf_counter()
+        queues = []
+        for name in STAGES:
+            size = self.queue_size or self.stage_workers[name] * 2
+            queues.append(queue.Queue(maxsize=size))
+
+        threads = []
+        for i, name in enumerate(STAGES):
+            outbox = queues[i + 1] if i + 1 < len(STAGES) else None
+            downstream = self.stage_workers[STAGES[i + 1]] if outbox is not None else 0
+            remaining = {'lock': threading.Lock(), 'count': self.stage_workers[name], 'downstream': downstream}
+            for n in range(self.stage_workers[name]):
+                thread = threading.Thread(target=self._stage_loop, args=(name, queues[i], outbox, remaining),
+                                          name=f"export-{name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        # 在调用线程中投放任务；队列满时阻塞，形成背压
+        try:
+            for job in jobs:
+                if self.cancelled:
+                    break
+                queues[0].put(_Task(job))
+        finally:
+            for _ in range(self.stage_workers[STAGES[0]]):
+                queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - start
+        return self.report()
+
+    def report(self):
+        """各阶段统计：处理数量、忙碌/等待时间、利用率"""
+        return {name: self.stats[name].as_dict(self.elapsed) for name in STAGES}
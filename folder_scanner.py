@@ -0,0 +1,87 @@
+import os
+import sys
+
+# 流式文件夹扫描 - 基于os.scandir递归遍历目录，分批产出图片路径，
+# 导入大型目录树时第一批图片可以立即使用，而无需等待整个目录扫描完成
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
+
+# 各格式文件头
+MAGIC_BYTES = (
+    b'\xff\xd8\xff',        # JPEG
+    b'\x89PNG\r\n\x1a\n',   # PNG
+    b'BM',                  # BMP
+    b'II*\x00',             # TIFF (little-endian)
+    b'MM\x00*',             # TIFF (big-endian)
+)
+
+
+def has_image_magic(path):
+    """检查文件头是否为支持的图片格式"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(8)
+    except OSError:
+        return False
+    return header.startswith(MAGIC_BYTES)
+
+
+def _is_hidden(entry):
+    if entry.name.startswith('.'):
+        return True
+    if os.name != 'nt':
+        return False
+    # Windows隐藏属性（Windows上scandir已带有文件属性，不需要额外的系统调用）
+    attrs = getattr(entry.stat(follow_symlinks=False), 'st_file_attributes', 0)
+    return bool(attrs & 0x2)
+
+
+def scan_images(root, recursive=True, skip_hidden=True, skip_dirs=(), check_magic=True,
+                batch_size=500, first_batch_size=32, on_error=None):
+    """扫描目录中的图片，以生成器方式分批产出路径列表
+
+    skip_dirs中的目录（如导出目录）不会被扫描；
+    第一批只需first_batch_size张即产出，之后批次逐步增大到batch_size；
+    无法读取的目录跳过，并调用on_error(目录, 异常)，未指定时输出到标准错误
+    """
+    skip = {os.path.normcase(os.path.abspath(d)) for d in skip_dirs if d}
+    stack = [root]
+    batch = []
+    limit = first_batch_size
+
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name.lower())
+        except OSError as e:
+            if on_error is not None:
+                on_error(directory, e)
+            else:
+                print(f"Error scanning {directory}: {e}", file=sys.stderr)
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                if skip_hidden and _is_hidden(entry):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and os.path.normcase(os.path.abspath(entry.path)) not in skip:
+                        subdirs.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    if check_magic and not has_image_magic(entry.path):
+                        continue
+                    batch.append(entry.path)
+                    if len(batch) >= limit:
+                        yield batch
+                        batch = []
+                        limit = min(limit * 2, batch_size)
+            except OSError:
+                continue
+
+        # 逆序入栈，使子目录按名称顺序处理
+        stack.extend(reversed(subdirs))
+
+    if batch:
+        yield batch
@@ -0,0 +1,115 @@
+import os
+import platform
+import sys
+import threading
+from functools import lru_cache
+from PIL import ImageFont
+
+import instrumentation
+
+# 字体注册表 - 启动时扫描一次系统字体目录，按(字体族, 字号)缓存FreeTypeFont，
+# 避免每张图片都重复探测字体路径和解析字体文件
+
+# 各字体族在不同系统上的候选字体文件（按优先级）
+FONT_FAMILIES = {
+    'Arial': ['arial.ttf', 'Arial.ttf', 'Helvetica.ttc', 'LiberationSans-Regular.ttf', 'DejaVuSans.ttf'],
+    'Times New Roman': ['times.ttf', 'Times New Roman.ttf', 'Times.ttc', 'LiberationSerif-Regular.ttf', 'DejaVuSerif.ttf'],
+    'Courier New': ['cour.ttf', 'Courier New.ttf', 'Courier.ttc', 'LiberationMono-Regular.ttf', 'DejaVuSansMono.ttf'],
+    'SimSun': ['simsun.ttc', 'Songti.ttc', 'NotoSerifCJK-Regular.ttc', 'NotoSansCJK-Regular.ttc'],
+    'SimHei': ['simhei.ttf', 'STHeiti Light.ttc', 'NotoSansCJK-Regular.ttc'],
+    'Microsoft YaHei': ['msyh.ttc', 'PingFang.ttc', 'NotoSansCJK-Regular.ttc'],
+}
+
+# 不含中文字形的字体族，文本包含中文时改用中文后备字体
+LATIN_ONLY_FAMILIES = {'Arial', 'Times New Roman', 'Courier New'}
+
+# 未指定字体或找不到指定字体时的后备顺序（中文字体优先）
+FALLBACK_FONTS = [
+    'simhei.ttf', 'simsun.ttc', 'msyh.ttc',                   # Windows
+    'PingFang.ttc', 'STHeiti Light.ttc',                      # macOS
+    'NotoSansCJK-Regular.ttc',                                # Linux
+    'arial.ttf', 'Helvetica.ttc', 'DejaVuSans.ttf'
+]
+
+
+def _font_dirs():
+    system = platform.system()
+    if system == 'Windows':
+        windir = os.environ.get('WINDIR', 'C:\\Windows')
+        dirs = [os.path.join(windir, 'Fonts')]
+        local = os.environ.get('LOCALAPPDATA')
+        if local:
+            dirs.append(os.path.join(local, 'Microsoft', 'Windows', 'Fonts'))
+        return dirs
+    elif system == 'Darwin':  # macOS
+        return ['/System/Library/Fonts', '/Library/Fonts', os.path.expanduser('~/Library/Fonts')]
+    else:
+        return ['/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.fonts'),
+                os.path.expanduser('~/.local/share/fonts')]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def discover():
+    """扫描系统字体目录，建立 小写文件名 -> 路径 的索引（只扫描一次）"""
+    global _index
+    with _index_lock:
+        if _index is not None:
+            return _index
+        index = {}
+        for font_dir in _font_dirs():
+            for root, _, files in os.walk(font_dir):
+                for name in files:
+                    if name.lower().endswith(('.ttf', '.ttc', '.otf')):
+                        index.setdefault(name.lower(), os.path.join(root, name))
+        _index = index
+        return _index
+
+
+def _find(filenames):
+    index = discover()
+    for name in filenames:
+        path = index.get(name.lower())
+        if path:
+            return path
+    return None
+
+
+def contains_cjk(text):
+    """文本是否包含中日韩字符"""
+    return any(ord(ch) >= 0x2E80 for ch in text)
+
+
+@lru_cache(maxsize=None)
+def resolve_font_path(family=None, cjk=False):
+    """解析字体族对应的字体文件路径，找不到时返回后备字体路径或None"""
+    path = None
+    if family in FONT_FAMILIES and not (cjk and family in LATIN_ONLY_FAMILIES):
+        path = _find(FONT_FAMILIES[family])
+    return path or _find(FALLBACK_FONTS)
+
+
+@lru_cache(maxsize=64)
+def _load(path, size):
+    if path:
+        try:
+            with instrumentation.timer('font'):
+                return ImageFont.truetype(path, size)
+        except (IOError, OSError) as e:
+            print(f"Font loading error: {e}", file=sys.stderr)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # 旧版Pillow的默认字体不支持字号
+        return ImageFont.load_default()
+
+
+def get_font(family=None, size=25, text=''):
+    """获取字体对象（按字体文件和字号缓存）
+
+    family为None或未知时使用后备字体；text包含中文而所选字体不含中文字形时自动改用中文字体
+    """
+    path = resolve_font_path(family, contains_cjk(text))
+    return _load(path, int(size))
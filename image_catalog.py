@@ -0,0 +1,159 @@
+import os
+from collections import OrderedDict
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QThread, Signal
+from PySide6.QtGui import QIcon, QPixmap
+
+from folder_scanner import scan_images
+from thumbnail_cache import ThumbnailLoader
+
+# 图片目录与虚拟化列表模型 - 按路径建立索引，只为可见行加载缩略图，
+# 十万张图片的导入和滚动都保持流畅且内存有界
+
+# 内存中最多保留的缩略图数量
+ICON_CACHE_SIZE = 2000
+
+
+class ImageCatalog:
+    """有序的图片路径集合，按路径查找为O(1)
+
+    从文件夹导入的图片记录相对该文件夹的路径，导出时在输出目录中保留子目录结构
+    """
+
+    def __init__(self):
+        self._paths = []
+        self._index = {}  # 路径 -> 行号
+        self._relative = {}  # 路径 -> 相对导入文件夹的路径
+
+    def add(self, paths, root=None):
+        """添加图片路径（忽略重复），root为导入的文件夹；返回实际新增的路径列表"""
+        added = []
+        for path in paths:
+            if path not in self._index:
+                self._index[path] = len(self._paths)
+                self._paths.append(path)
+                if root is not None:
+                    self._relative[path] = os.path.relpath(path, root)
+                added.append(path)
+        return added
+
+    def relative_path(self, path):
+        """导出时使用的相对路径：从文件夹导入的图片为相对该文件夹的路径，否则为文件名"""
+        return self._relative.get(path) or os.path.basename(path)
+
+    def index_of(self, path):
+        """返回路径所在行号，不存在时返回-1"""
+        return self._index.get(path, -1)
+
+    def __contains__(self, path):
+        return path in self._index
+
+    def __getitem__(self, row):
+        return self._paths[row]
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __iter__(self):
+        return iter(self._paths)
+
+
+class ImageListModel(QAbstractListModel):
+    """图片列表模型：视图请求某行图标时才加载缩略图"""
+
+    def __init__(self, catalog, parent=None):
+        super().__init__(parent)
+        self.catalog = catalog
+        self._icons = OrderedDict()  # 路径 -> QIcon（LRU）
+        self._pending = set()
+        self._failed = set()
+
+        self.thumbnail_loader = ThumbnailLoader(parent=self)
+        self.thumbnail_loader.thumbnail_ready.connect(self._on_thumbnail_ready)
+        self.thumbnail_loader.thumbnail_failed.connect(self._on_thumbnail_failed)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.catalog)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.catalog[index.row()]
+
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        elif role == Qt.DecorationRole:
+            icon = self._icons.get(path)
+            if icon is not None:
+                self._icons.move_to_end(path)
+                return icon
+            # 只有可见行会被请求图标，此时才加载缩略图
+            if path not in self._pending and path not in self._failed:
+                self._pending.add(path)
+                self.thumbnail_loader.request([path])
+            return None
+        elif role == Qt.ToolTipRole:
+            return path
+        elif role == Qt.UserRole:
+            return path
+        return None
+
+    def add_images(self, paths, root=None):
+        """添加图片（root为导入的文件夹），返回实际新增的路径列表"""
+        paths = [p for p in dict.fromkeys(paths) if p not in self.catalog]
+        if not paths:
+            return []
+        first = len(self.catalog)
+        self.beginInsertRows(QModelIndex(), first, first + len(paths) - 1)
+        added = self.catalog.add(paths, root)
+        self.endInsertRows()
+        return added
+
+    def stop(self):
+        self.thumbnail_loader.stop()
+
+    def _on_thumbnail_ready(self, path, qimg):
+        self._pending.discard(path)
+        self._icons[path] = QIcon(QPixmap.fromImage(qimg))
+        # 淘汰最久未显示的图标，滚动回来时会从磁盘缓存重新读取
+        while len(self._icons) > ICON_CACHE_SIZE:
+            self._icons.popitem(last=False)
+
+        row = self.catalog.index_of(path)
+        if row >= 0:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def _on_thumbnail_failed(self, path, message):
+        self._pending.discard(path)
+        self._failed.add(path)
+        print(f"Error creating thumbnail for {path}: {message}")
+
+
+class FolderScanWorker(QThread):
+    """在后台线程中扫描文件夹，每找到一批图片即通过信号交给GUI加入目录"""
+
+    # 一批图片路径
+    batch_found = Signal(list)
+    # 找到的图片总数, 是否被取消
+    finished_scan = Signal(int, bool)
+
+    def __init__(self, root, recursive=True, skip_dirs=(), parent=None):
+        super().__init__(parent)
+        self.root = root
+        self.recursive = recursive
+        self.skip_dirs = skip_dirs
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        total = 0
+        for batch in scan_images(self.root, recursive=self.recursive, skip_dirs=self.skip_dirs):
+            if self._cancelled:
+                break
+            total += len(batch)
+            self.batch_found.emit(batch)
+        self.finished_scan.emit(total, self._cancelled)
@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+
+# 分阶段计时 - 按级别开启，在渲染核心内部（字体加载、图章渲染、合成）用单调时钟计时，
+# 计入当前线程正在处理的图片的耗时字典，再按批次汇总；
+# 关闭时timer()/collect()只返回共享的空上下文，不读时钟也不分配对象
+
+OFF = 0
+TIMING = 1
+LEVELS = {'off': OFF, 'timing': TIMING}
+
+# 通过环境变量开启（如 WATERMARK_TIMING=timing），子进程继承同样的级别
+ENV_VAR = 'WATERMARK_TIMING'
+
+# 报告中各阶段的显示名称和顺序；font/render/composite是watermark阶段的组成部分
+STAGE_LABELS = {
+    'read': '读取',
+    'tiled': '分块处理',
+    'decode': '解码',
+    'watermark': '水印',
+    'font': '字体',
+    'render': '渲染',
+    'composite': '合成',
+    'encode': '编码',
+    'write': '写入',
+    'hash': '哈希'
+}
+WATERMARK_PARTS = ('font', 'render', 'composite')
+
+
+def _parse_level(value):
+    value = (value or '').strip().lower()
+    if value in LEVELS:
+        return LEVELS[value]
+    return TIMING if value in ('1', 'on', 'true') else OFF
+
+
+level = _parse_level(os.environ.get(ENV_VAR))
+_local = threading.local()
+
+
+def set_level(new_level):
+    """设置计时级别（OFF/TIMING），同时写入环境变量，之后启动的子进程使用相同级别"""
+    global level
+    level = new_level
+    name = next((k for k, v in LEVELS.items() if v == new_level), 'off')
+    os.environ[ENV_VAR] = name
+
+
+def enabled():
+    return level >= TIMING
+
+
+class _NullContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+class _Collector:
+    """在当前线程中把计时结果累加到timings字典"""
+
+    __slots__ = ('timings', 'previous')
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'timings', None)
+        _local.timings = self.timings
+        return self.timings
+
+    def __exit__(self, *exc):
+        _local.timings = self.previous
+        return False
+
+
+class _Timer:
+    """计时一个阶段；嵌套的计时只计入最内层阶段（如渲染中的字体加载不重复计入渲染）"""
+
+    __slots__ = ('stage', 'start', 'child', 'parent')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.child = 0.0
+        self.parent = None
+        self.start = 0.0
+
+    def __enter__(self):
+        self.parent = getattr(_local, 'timer', None)
+        _local.timer = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _local.timer = self.parent
+        if self.parent is not None:
+            self.parent.child += elapsed
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed - self.child
+        return False
+
+
+def collect(timings):
+    """with collect(timings): 期间当前线程中的计时累加到timings字典"""
+    if level < TIMING:
+        return _NULL
+    return _Collector(timings)
+
+
+def timer(stage):
+    """with timer('render'): 计时一个阶段，结果计入当前线程的collect()字典"""
+    if level < TIMING:
+        return _NULL
+    return _Timer(stage)
+
+
+# 报告中编码档位的显示名称
+PROFILE_LABELS = {
+    'fast': '快速',
+    'balanced': '均衡',
+    'smallest': '最小'
+}
+
+
+def format_bytes(size):
+    """字节数的可读形式，如12.3 MB"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} GB"
+
+
+def format_utilisation(stage_stats):
+    """流水线各阶段的线程利用率，如"读取 5% x2, 解码 96% x4"；接近100%的阶段是瓶颈"""
+    return ", ".join(f"{STAGE_LABELS.get(name, name)} {stats['utilisation']:.0%} x{stats['workers']}"
+                     for name, stats in stage_stats.items())
+
+
+class BatchReport:
+    """一批图片的各阶段累计耗时，以及按编码档位统计的写出字节数和编码耗时（线程安全）"""
+
+    def __init__(self):
+        self.stages = {}
+        self.images = 0
+        self.outputs = {}  # 编码档位 -> {'images': 数量, 'bytes': 写出字节数, 'encode': 编码耗时}
+        self._lock = threading.Lock()
+
+    def add(self, timings, output_bytes=None, profile=None):
+        """累加一张图片的耗时；导出成功时传入输出文件大小和所用编码档位"""
+        with self._lock:
+            self.images += 1
+            for stage, seconds in timings.items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            if output_bytes is not None:
+                output = self.outputs.setdefault(profile, {'images': 0, 'bytes': 0, 'encode': 0.0})
+                output['images'] += 1
+                output['bytes'] += output_bytes
+                # 分块处理时编码与其它阶段交织在一起，计入分块处理耗时
+                output['encode'] += timings.get('encode', timings.get('tiled', 0.0))
+
+    def as_dict(self):
+        return {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+
+    def outputs_as_dict(self):
+        return {profile: {'images': output['images'], 'bytes': output['bytes'],
+                          'encode': round(output['encode'], 4)}
+                for profile, output in self.outputs.items()}
+
+    def format_outputs(self):
+        """如"均衡 12张 45.2 MB, 编码 3.10s"；没有成功导出的图片时返回空字符串"""
+        parts = []
+        for profile, output in self.outputs.items():
+            text = f"{output['images']}张 {format_bytes(output['bytes'])}"
+            if output['encode']:
+                text += f", 编码 {output['encode']:.2f}s"
+            if profile:
+                text = f"{PROFILE_LABELS.get(profile, profile)} " + text
+            parts.append(text)
+        return "; ".join(parts)
+
+    def format(self):
+        """如"解码 1.20s, 水印 0.30s（字体 0.01s, 渲染 0.10s, 合成 0.19s）, 编码 2.10s"；没有数据时返回空字符串"""
+        def item(stage):
+            return f"{STAGE_LABELS.get(stage, stage)} {self.stages[stage]:.2f}s"
+
+        parts = []
+        order = list(STAGE_LABELS) + sorted(set(self.stages) - set(STAGE_LABELS))
+        for stage in order:
+            if stage not in self.stages or stage in WATERMARK_PARTS:
+                continue
+            text = item(stage)
+            if stage == 'watermark':
+                details = [item(part) for part in WATERMARK_PARTS if part in self.stages]
+                if details:
+                    text += "（" + ", ".join(details) + "）"
+            parts.append(text)
+        # 没有watermark阶段（如预览）时单独列出
+        if 'watermark' not in self.stages:
+            parts.extend(item(part) for part in WATERMARK_PARTS if part in self.stages)
+        return ", ".join(parts)
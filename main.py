@@ -1,18 +1,28 @@
 import sys
 import os
 import json
-from PySide6.QtWidgets import (QApplication, QMainWindow, QFileDialog, QListWidget, QListWidgetItem,
+import multiprocessing
+from PySide6.QtWidgets import (QApplication, QMainWindow, QFileDialog, QListWidget,
                             QLabel, QPushButton, QSlider, QComboBox, QLineEdit, QColorDialog,
-                            QVBoxLayout, QHBoxLayout, QGridLayout, QWidget, QTabWidget,
-                            QGroupBox, QRadioButton, QCheckBox, QSpinBox, QMessageBox)
-from PySide6.QtGui import QImage, QPixmap, QFont, QColor, QDrag, QIcon
-from PySide6.QtCore import Qt, QSize, QPoint, QMimeData
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageColor
+                            QListView, QVBoxLayout, QHBoxLayout, QGridLayout, QWidget, QTabWidget,
+                            QGroupBox, QRadioButton, QCheckBox, QSpinBox, QMessageBox,
+                            QProgressDialog)
+from PySide6.QtGui import QPixmap, QFont, QColor
+from PySide6.QtCore import Qt, QSize
+from PIL import Image
+
+import instrumentation
+import watermark_core
+from watermark_spec import PATTERN_POSITION, WatermarkSpec
+from batch_export import DEFAULT_ENGINE, ENGINE_LABELS, ENGINES, BatchExportWorker
+from preview_renderer import PreviewRenderer
+from thumbnail_cache import THUMBNAIL_SIZE
+from image_catalog import FolderScanWorker, ImageCatalog, ImageListModel
 
 class WatermarkApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.images = []  # 存储导入的图片路径
+        self.images = ImageCatalog()  # 存储导入的图片路径（按路径索引）
         self.current_image_index = -1
         self.watermark_settings = {
             'type': 'text',  # 'text' 或 'image'
@@ -26,10 +36,15 @@ class WatermarkApp(QMainWindow):
             'rotation': 0,
             'effects': {
                 'shadow': False,
-                'outline': False
+                'outline': False,
+                'glow': False
             },
             'image_path': '',
-            'image_scale': 100  # 百分比
+            'image_scale': 100,  # 百分比
+            'pattern': {  # 平铺模式（位置为平铺时）
+                'spacing': 100,  # 相邻水印的间距（像素）
+                'stagger': 50  # 隔行水平错开的百分比
+            }
         }
         # 初始化导出设置
         self.export_settings = {
@@ -39,6 +54,14 @@ class WatermarkApp(QMainWindow):
             'prefix': 'wm_',
             'suffix': '_watermarked'
         }
+        self.export_worker = None  # 后台批量导出线程
+        self.scan_worker = None  # 后台文件夹扫描线程
+        # 后台预览渲染
+        self.preview_renderer = PreviewRenderer(self)
+        self.preview_renderer.rendered.connect(self.on_preview_rendered)
+        self.preview_renderer.failed.connect(self.on_preview_failed)
+        # 图片列表模型，只为可见行加载缩略图
+        self.image_model = ImageListModel(self.images, self)
         self.init_ui()
         
     def init_ui(self):
@@ -82,9 +105,11 @@ class WatermarkApp(QMainWindow):
         title.setFont(QFont('Arial', 12, QFont.Bold))
         
         # 图片列表
-        self.image_list = QListWidget()
-        self.image_list.setIconSize(QSize(80, 80))
-        self.image_list.itemClicked.connect(self.on_image_selected)
+        self.image_list = QListView()
+        self.image_list.setModel(self.image_model)
+        self.image_list.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.image_list.setUniformItemSizes(True)  # 所有行等高，大量图片时无需逐行计算布局
+        self.image_list.clicked.connect(self.on_image_selected)
         
         # 导入按钮
         import_btn_layout = QHBoxLayout()
@@ -95,10 +120,14 @@ class WatermarkApp(QMainWindow):
         import_btn_layout.addWidget(self.import_file_btn)
         import_btn_layout.addWidget(self.import_folder_btn)
         
+        self.recursive_check = QCheckBox("包含子文件夹")
+        self.recursive_check.setChecked(True)
+        
         # 添加到布局
         layout.addWidget(title)
         layout.addWidget(self.image_list)
         layout.addLayout(import_btn_layout)
+        layout.addWidget(self.recursive_check)
         
         self.image_list_panel.setLayout(layout)
         
@@ -236,8 +265,13 @@ class WatermarkApp(QMainWindow):
         self.outline_check.setChecked(self.watermark_settings['effects']['outline'])
         self.outline_check.stateChanged.connect(self.update_outline_effect)
         
+        self.glow_check = QCheckBox("发光效果")
+        self.glow_check.setChecked(self.watermark_settings['effects']['glow'])
+        self.glow_check.stateChanged.connect(self.update_glow_effect)
+        
         effects_layout.addWidget(self.shadow_check)
         effects_layout.addWidget(self.outline_check)
+        effects_layout.addWidget(self.glow_check)
         effects_group.setLayout(effects_layout)
         
         # 添加到布局
@@ -326,6 +360,13 @@ class WatermarkApp(QMainWindow):
             btn.clicked.connect(lambda checked, p=pos_name: self.set_position(p))
             position_layout.addWidget(btn, row, col)
             self.position_buttons[pos_name] = btn
+        
+        # 平铺整幅图像（按旋转角度倾斜）
+        pattern_btn = QPushButton("平铺")
+        pattern_btn.setCheckable(True)
+        pattern_btn.clicked.connect(lambda checked: self.set_position(PATTERN_POSITION))
+        position_layout.addWidget(pattern_btn, 3, 0, 1, 3)
+        self.position_buttons[PATTERN_POSITION] = pattern_btn
             
         # 设置默认选中
         if self.watermark_settings['position'] in self.position_buttons:
@@ -333,6 +374,28 @@ class WatermarkApp(QMainWindow):
         
         position_group.setLayout(position_layout)
         
+        # 平铺设置
+        pattern_group = QGroupBox("平铺设置")
+        pattern_layout = QGridLayout()
+        
+        pattern_layout.addWidget(QLabel("间距:"), 0, 0)
+        self.pattern_spacing_spin = QSpinBox()
+        self.pattern_spacing_spin.setRange(0, 2000)
+        self.pattern_spacing_spin.setSuffix(" px")
+        self.pattern_spacing_spin.setValue(self.watermark_settings['pattern']['spacing'])
+        self.pattern_spacing_spin.valueChanged.connect(self.update_pattern_spacing)
+        pattern_layout.addWidget(self.pattern_spacing_spin, 0, 1)
+        
+        pattern_layout.addWidget(QLabel("隔行错开:"), 1, 0)
+        self.pattern_stagger_spin = QSpinBox()
+        self.pattern_stagger_spin.setRange(0, 100)
+        self.pattern_stagger_spin.setSuffix(" %")
+        self.pattern_stagger_spin.setValue(self.watermark_settings['pattern']['stagger'])
+        self.pattern_stagger_spin.valueChanged.connect(self.update_pattern_stagger)
+        pattern_layout.addWidget(self.pattern_stagger_spin, 1, 1)
+        
+        pattern_group.setLayout(pattern_layout)
+        
         # 旋转设置
         rotation_group = QGroupBox("旋转设置")
         rotation_layout = QVBoxLayout()
@@ -357,6 +420,7 @@ class WatermarkApp(QMainWindow):
         
         # 添加到布局
         layout.addWidget(position_group)
+        layout.addWidget(pattern_group)
         layout.addWidget(rotation_group)
         layout.addStretch()
         
@@ -424,23 +488,73 @@ class WatermarkApp(QMainWindow):
         
         self.format_jpeg = QRadioButton("JPEG")
         self.format_png = QRadioButton("PNG")
+        self.format_webp = QRadioButton("WebP")
+        self.format_avif = QRadioButton("AVIF")
         
         self.format_jpeg.setChecked(True)
         
+        # AVIF需要带libavif编译的Pillow
+        available_formats = watermark_core.available_output_formats()
+        self.format_webp.setEnabled('WEBP' in available_formats)
+        self.format_avif.setEnabled('AVIF' in available_formats)
+        
         format_layout.addWidget(self.format_jpeg)
         format_layout.addWidget(self.format_png)
+        format_layout.addWidget(self.format_webp)
+        format_layout.addWidget(self.format_avif)
         
-        # JPEG质量设置
+        # 质量设置（JPEG、WebP、AVIF）
         quality_layout = QHBoxLayout()
-        quality_layout.addWidget(QLabel("JPEG质量:"))
+        quality_layout.addWidget(QLabel("质量:"))
         self.quality_slider = QSlider(Qt.Horizontal)
         self.quality_slider.setRange(1, 100)
         self.quality_slider.setValue(85)
         quality_layout.addWidget(self.quality_slider)
         format_layout.addLayout(quality_layout)
         
+        # 编码档位：快速编码最快，最小文件最小
+        profile_layout = QHBoxLayout()
+        profile_layout.addWidget(QLabel("编码档位:"))
+        self.profile_combo = QComboBox()
+        for profile in watermark_core.ENCODER_PROFILES:
+            self.profile_combo.addItem(instrumentation.PROFILE_LABELS[profile], profile)
+        self.profile_combo.setCurrentIndex(self.profile_combo.findData(watermark_core.DEFAULT_PROFILE))
+        profile_layout.addWidget(self.profile_combo)
+        format_layout.addLayout(profile_layout)
+        
+        # 导出引擎：分阶段流水线（线程）或多进程，多核机器上水印合成较重时多进程更快
+        engine_layout = QHBoxLayout()
+        engine_layout.addWidget(QLabel("导出引擎:"))
+        self.engine_combo = QComboBox()
+        for engine in ENGINES:
+            self.engine_combo.addItem(ENGINE_LABELS[engine], engine)
+        self.engine_combo.setCurrentIndex(self.engine_combo.findData(DEFAULT_ENGINE))
+        engine_layout.addWidget(self.engine_combo)
+        format_layout.addLayout(engine_layout)
+        
         format_group.setLayout(format_layout)
         
+        # 尺寸调整
+        resize_group = QGroupBox("尺寸调整")
+        resize_layout = QHBoxLayout()
+        
+        self.resize_mode_combo = QComboBox()
+        self.resize_mode_combo.addItem("原始尺寸", None)
+        self.resize_mode_combo.addItem("按宽度", "width")
+        self.resize_mode_combo.addItem("按高度", "height")
+        self.resize_mode_combo.addItem("按百分比", "percent")
+        self.resize_mode_combo.currentIndexChanged.connect(self.update_resize_mode)
+        resize_layout.addWidget(self.resize_mode_combo)
+        
+        self.resize_value_spin = QSpinBox()
+        self.resize_value_spin.setRange(1, 20000)
+        self.resize_value_spin.setValue(2048)
+        self.resize_value_spin.setSuffix(" px")
+        self.resize_value_spin.setEnabled(False)
+        resize_layout.addWidget(self.resize_value_spin)
+        
+        resize_group.setLayout(resize_layout)
+        
         # 导出按钮
         self.export_btn = QPushButton("导出图片")
         self.export_btn.clicked.connect(self.export_images)
@@ -449,11 +563,25 @@ class WatermarkApp(QMainWindow):
         layout.addWidget(output_group)
         layout.addWidget(naming_group)
         layout.addWidget(format_group)
+        layout.addWidget(resize_group)
         layout.addWidget(self.export_btn)
         layout.addStretch()
         
         tab.setLayout(layout)
         return tab
+    
+    def update_resize_mode(self):
+        # 切换缩放方式时调整数值的单位和范围
+        mode = self.resize_mode_combo.currentData()
+        self.resize_value_spin.setEnabled(mode is not None)
+        if mode == "percent" and self.resize_value_spin.suffix() != " %":
+            self.resize_value_spin.setRange(1, 400)
+            self.resize_value_spin.setSuffix(" %")
+            self.resize_value_spin.setValue(50)
+        elif mode in ("width", "height") and self.resize_value_spin.suffix() != " px":
+            self.resize_value_spin.setRange(1, 20000)
+            self.resize_value_spin.setSuffix(" px")
+            self.resize_value_spin.setValue(2048)
         
     def create_template_tab(self):
         # 创建模板选项卡
@@ -512,50 +640,51 @@ class WatermarkApp(QMainWindow):
             self.add_images(file_paths)
     
     def import_folder(self):
+        if self.scan_worker is not None:
+            # 上一次扫描尚未结束
+            return
+        
         folder_path = QFileDialog.getExistingDirectory(self, "选择文件夹")
         if folder_path:
-            image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
-            file_paths = []
-            for file in os.listdir(folder_path):
-                ext = os.path.splitext(file)[1].lower()
-                if ext in image_extensions:
-                    file_paths.append(os.path.join(folder_path, file))
-            if file_paths:
-                self.add_images(file_paths)
-            else:
-                QMessageBox.information(self, "提示", "所选文件夹中没有支持的图片文件")
+            # 跳过导出目录，避免把已加水印的图片再导入
+            output_dir = self.output_path_label.text()
+            skip_dirs = [output_dir] if output_dir != "未选择输出目录" else []
+            
+            # 在后台线程中流式扫描，每找到一批图片就加入列表
+            self.import_folder_btn.setEnabled(False)
+            self.statusBar().showMessage(f'正在扫描: {folder_path}')
+            self.scan_worker = FolderScanWorker(
+                folder_path, recursive=self.recursive_check.isChecked(), skip_dirs=skip_dirs, parent=self
+            )
+            self.scan_worker.batch_found.connect(lambda batch, root=folder_path: self.add_images(batch, root))
+            self.scan_worker.finished_scan.connect(self.on_folder_scan_finished)
+            self.scan_worker.start()
     
-    def add_images(self, file_paths):
-        for path in file_paths:
-            if path not in self.images:
-                self.images.append(path)
-                filename = os.path.basename(path)
-                
-                # 创建缩略图
-                try:
-                    img = Image.open(path)
-                    img.thumbnail((80, 80))
-                    img = img.convert("RGBA")
-                    data = img.tobytes("raw", "RGBA")
-                    qimg = QImage(data, img.width, img.height, QImage.Format_RGBA8888)
-                    pixmap = QPixmap.fromImage(qimg)
-                    
-                    # 添加到列表
-                    item = QListWidgetItem(QIcon(pixmap), filename)
-                    item.setData(Qt.UserRole, path)
-                    self.image_list.addItem(item)
-                except Exception as e:
-                    print(f"Error creating thumbnail for {path}: {e}")
+    def on_folder_scan_finished(self, total, cancelled):
+        self.scan_worker.wait()
+        self.scan_worker.deleteLater()
+        self.scan_worker = None
+        self.import_folder_btn.setEnabled(True)
+        if cancelled:
+            return
+        if total == 0:
+            QMessageBox.information(self, "提示", "所选文件夹中没有支持的图片文件")
+        else:
+            self.statusBar().showMessage(f'扫描完成: 找到 {total} 张图片')
+    
+    def add_images(self, file_paths, root=None):
+        # 缩略图在对应行可见时才由模型在后台加载；从文件夹导入时root为该文件夹
+        self.image_model.add_images(file_paths, root)
         
         # 如果这是第一张图片，选中它
         if self.current_image_index == -1 and self.images:
-            self.image_list.setCurrentRow(0)
-            self.on_image_selected(self.image_list.item(0))
+            index = self.image_model.index(0)
+            self.image_list.setCurrentIndex(index)
+            self.on_image_selected(index)
     
-    def on_image_selected(self, item):
-        path = item.data(Qt.UserRole)
-        self.current_image_index = self.images.index(path)
-        self.update_preview()
+    def on_image_selected(self, index):
+        self.current_image_index = index.row()
+        self.update_preview(high_quality=True)
     
     # 水印设置方法
     def update_text_watermark(self):
@@ -582,13 +711,15 @@ class WatermarkApp(QMainWindow):
         self.update_preview()
     
     def update_shadow_effect(self, state):
-        self.watermark_settings['effects']['shadow'] = state == Qt.Checked
-        print(f"阴影效果设置: {self.watermark_settings['effects']['shadow']}")
+        self.watermark_settings['effects']['shadow'] = self.shadow_check.isChecked()
         self.update_preview()
     
     def update_outline_effect(self, state):
-        self.watermark_settings['effects']['outline'] = state == Qt.Checked
-        print(f"描边效果设置: {self.watermark_settings['effects']['outline']}")
+        self.watermark_settings['effects']['outline'] = self.outline_check.isChecked()
+        self.update_preview()
+    
+    def update_glow_effect(self, state):
+        self.watermark_settings['effects']['glow'] = self.glow_check.isChecked()
         self.update_preview()
     
     def select_watermark_image(self):
@@ -616,6 +747,14 @@ class WatermarkApp(QMainWindow):
         self.watermark_settings['rotation'] = value
         self.update_preview()
     
+    def update_pattern_spacing(self, value):
+        self.watermark_settings['pattern']['spacing'] = value
+        self.update_preview()
+    
+    def update_pattern_stagger(self, value):
+        self.watermark_settings['pattern']['stagger'] = value
+        self.update_preview()
+    
     # 导出方法
     def select_output_directory(self):
         dir_path = QFileDialog.getExistingDirectory(self, "选择输出目录")
@@ -733,6 +872,7 @@ class WatermarkApp(QMainWindow):
         
         self.shadow_check.setChecked(self.watermark_settings['effects']['shadow'])
         self.outline_check.setChecked(self.watermark_settings['effects']['outline'])
+        self.glow_check.setChecked(self.watermark_settings['effects'].get('glow', False))
         
         # 图片水印
         if self.watermark_settings['image_path']:
@@ -748,6 +888,10 @@ class WatermarkApp(QMainWindow):
         
         self.rotation_slider.setValue(self.watermark_settings['rotation'])
         self.rotation_spin.setValue(self.watermark_settings['rotation'])
+        
+        pattern = self.watermark_settings.get('pattern') or {}
+        self.pattern_spacing_spin.setValue(pattern.get('spacing', 100))
+        self.pattern_stagger_spin.setValue(pattern.get('stagger', 50))
     
     # 水印应用和预览
     def apply_watermark(self):
@@ -757,9 +901,6 @@ class WatermarkApp(QMainWindow):
         
         # 保存带水印的图片
         try:
-            # 导入简化版水印功能
-            import simple_watermark
-            
             # 获取当前图片路径
             image_path = self.images[self.current_image_index]
             
@@ -790,47 +931,25 @@ class WatermarkApp(QMainWindow):
                 
             save_path = os.path.join(save_dir, save_filename)
             
-            # 应用水印
+            # 应用水印（与预览和批量导出使用同一个编译后的规格）
             if self.tabs.currentIndex() == 0:  # 如果当前是文本水印选项卡
                 self.watermark_settings['type'] = 'text'
-                
-                # 获取文本水印参数
-                text = self.watermark_settings['text']
-                font_size = int(self.watermark_settings['font_size'])
-                color = self.watermark_settings['color']
-                position = self.watermark_settings['position']
-                opacity = int(self.watermark_settings['opacity'] * 255 / 100)  # 转换为0-255范围
-                rotation = self.watermark_settings['rotation']
-                effects = self.watermark_settings['effects']
-                
-                # 应用文本水印
-                success = simple_watermark.apply_text_watermark(
-                    image_path, save_path, text, font_size, color, 
-                    position, opacity, rotation, effects
-                )
             else:  # 如果当前是图片水印选项卡
                 self.watermark_settings['type'] = 'image'
                 
                 # 检查水印图片路径
                 if not self.watermark_settings['image_path'] or not os.path.exists(self.watermark_settings['image_path']):
                     raise Exception("水印图片路径无效")
-                
-                # 获取图片水印参数
-                watermark_path = self.watermark_settings['image_path']
-                position = self.watermark_settings['position']
-                opacity = int(self.watermark_settings['opacity'] * 255 / 100)  # 转换为0-255范围
-                rotation = self.watermark_settings['rotation']
-                scale = self.watermark_settings['image_scale'] / 100.0
-                
-                # 应用图片水印
-                success = simple_watermark.apply_image_watermark(
-                    image_path, save_path, watermark_path, position, 
-                    opacity, rotation, scale
-                )
             
-            # 检查水印应用结果
-            if not success:
-                raise Exception("水印应用失败")
+            output_format = Image.registered_extensions().get(ext.lower(), 'PNG')
+            watermark_core.export_image({
+                'image_path': image_path,
+                'output_path': save_path,
+                'spec': WatermarkSpec.compile(self.watermark_settings),
+                'output_format': output_format,
+                'quality': self.quality_slider.value() if output_format in watermark_core.LOSSY_FORMATS else None,
+                'profile': self.profile_combo.currentData()
+            })
             
             # 更新预览
             self.update_preview()
@@ -845,359 +964,60 @@ class WatermarkApp(QMainWindow):
             import traceback
             traceback.print_exc()
     
-    def update_preview(self):
+    def update_preview(self, high_quality=False):
         if self.current_image_index == -1 or not self.images:
             return
         
-        try:
-            # 打开原图
-            image_path = self.images[self.current_image_index]
-            img = Image.open(image_path).convert("RGBA")  # 确保图像是RGBA模式
-            
-            # 获取预览区域的实际大小，减去边距和标题高度
-            preview_area_width = max(self.preview_label.width() - 40, 600)  # 增加边距
-            preview_area_height = max(self.preview_label.height() - 40, 500)  # 增加边距
-            
-            # 如果预览区域还没有初始化，使用更大的默认值
-            if preview_area_width <= 600 or preview_area_height <= 500:
-                preview_area_width = 800
-                preview_area_height = 600
-            
-            # 计算保持长宽比的最佳缩放比例
-            width_ratio = preview_area_width / img.width
-            height_ratio = preview_area_height / img.height
-            scale_ratio = min(width_ratio, height_ratio)  # 选择较小的比例以确保图片完全显示
-            
-            # 如果图片很小，允许适度放大但不超过2倍
-            if scale_ratio > 2.0:
-                scale_ratio = 2.0
-            
-            # 计算预览图尺寸
-            preview_width = int(img.width * scale_ratio)
-            preview_height = int(img.height * scale_ratio)
-            
-            # 创建预览图 - 使用高质量重采样
-            if scale_ratio < 1.0:
-                # 缩小时使用LANCZOS
-                preview_img = img.resize((preview_width, preview_height), Image.Resampling.LANCZOS)
-            else:
-                # 放大时使用BICUBIC
-                preview_img = img.resize((preview_width, preview_height), Image.Resampling.BICUBIC)
-            
-            # 创建预览图的副本用于应用水印
-            watermarked_preview = preview_img.copy()
-            
-            # 应用水印
-            if self.watermark_settings['type'] == 'text':
-                self.apply_text_watermark_to_image(watermarked_preview)
-            else:
-                self.apply_image_watermark_to_image(watermarked_preview)
-            
-            # 转换为QPixmap并显示
-            data = watermarked_preview.tobytes("raw", "RGBA")
-            qimg = QImage(data, watermarked_preview.width, watermarked_preview.height, QImage.Format_RGBA8888)
-            pixmap = QPixmap.fromImage(qimg)
-            
-            # 设置pixmap并保持长宽比
-            self.preview_label.setPixmap(pixmap)
-            self.preview_label.setScaledContents(False)  # 关闭自动缩放以保持长宽比
-            self.preview_label.setAlignment(Qt.AlignCenter)  # 居中显示
-            
-            # 更新状态栏显示图片信息
-            scale_percent = int(scale_ratio * 100)
-            self.statusBar().showMessage(f'预览: {os.path.basename(image_path)} - 原始: {img.width}×{img.height} - 预览: {preview_width}×{preview_height} ({scale_percent}%)')
-            
-        except Exception as e:
-            self.preview_label.setText(f"预览失败: {str(e)}")
-            print(f"Preview error: {e}")
-            self.statusBar().showMessage('预览失败')
-    
-    def apply_text_watermark_to_image(self, img):
-        """将文本水印应用到图像上"""
-        # 确保图像是RGBA模式
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        # 创建一个透明图层用于绘制水印
-        watermark_layer = Image.new('RGBA', img.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(watermark_layer)
-        
-        # 确保字体大小是整数
-        font_size = int(self.watermark_settings['font_size'])
-        
-        # 直接使用默认字体，避免找不到字体的问题
-        font = ImageFont.load_default()
+        # 获取预览区域的实际大小，减去边距和标题高度
+        preview_area_width = max(self.preview_label.width() - 40, 600)  # 增加边距
+        preview_area_height = max(self.preview_label.height() - 40, 500)  # 增加边距
         
-        # 尝试根据操作系统获取系统字体
-        try:
-            import platform
-            system = platform.system()
-            if system == 'Windows':
-                # Windows系统常见字体
-                font_paths = [
-                    "C:\\Windows\\Fonts\\simhei.ttf",  # 黑体
-                    "C:\\Windows\\Fonts\\simsun.ttc",  # 宋体
-                    "C:\\Windows\\Fonts\\msyh.ttc",    # 微软雅黑
-                    "C:\\Windows\\Fonts\\arial.ttf"    # Arial
-                ]
-                
-                for path in font_paths:
-                    if os.path.exists(path):
-                        try:
-                            font = ImageFont.truetype(path, font_size)
-                            break
-                        except:
-                            continue
-            elif system == 'Darwin':  # macOS
-                # macOS系统常见字体
-                font_paths = [
-                    "/System/Library/Fonts/PingFang.ttc",
-                    "/System/Library/Fonts/STHeiti Light.ttc",
-                    "/System/Library/Fonts/Helvetica.ttc"
-                ]
-                
-                for path in font_paths:
-                    if os.path.exists(path):
-                        try:
-                            font = ImageFont.truetype(path, font_size)
-                            break
-                        except:
-                            continue
-            elif system == 'Linux':
-                # Linux系统常见字体
-                font_paths = [
-                    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc"
-                ]
-                
-                for path in font_paths:
-                    if os.path.exists(path):
-                        try:
-                            font = ImageFont.truetype(path, font_size)
-                            break
-                        except:
-                            continue
-        except Exception as e:
-            print(f"Font loading error: {e}")
-        
-        # 计算文本大小
-        text = self.watermark_settings['text']
-        try:
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-        except:
-            # 旧版Pillow兼容
-            text_width, text_height = draw.textsize(text, font=font)
-        
-        # 计算位置
-        position = self.watermark_settings['position']
-        margin = 10
-        
-        if position == 'top_left':
-            x, y = margin, margin
-        elif position == 'top_center':
-            x, y = (img.width - text_width) / 2, margin
-        elif position == 'top_right':
-            x, y = img.width - text_width - margin, margin
-        elif position == 'middle_left':
-            x, y = margin, (img.height - text_height) / 2
-        elif position == 'center':
-            x, y = (img.width - text_width) / 2, (img.height - text_height) / 2
-        elif position == 'middle_right':
-            x, y = img.width - text_width - margin, (img.height - text_height) / 2
-        elif position == 'bottom_left':
-            x, y = margin, img.height - text_height - margin
-        elif position == 'bottom_center':
-            x, y = (img.width - text_width) / 2, img.height - text_height - margin
-        else:  # bottom_right
-            x, y = img.width - text_width - margin, img.height - text_height - margin
-        
-        # 处理颜色 - 与simple_watermark.py保持一致
-        color = self.watermark_settings['color']
-        if isinstance(color, str):
-            color_map = {
-                'white': (255, 255, 255),
-                'black': (0, 0, 0),
-                'red': (255, 0, 0),
-                'blue': (0, 0, 255),
-                'green': (0, 255, 0),
-                'yellow': (255, 255, 0),
-                'cyan': (0, 255, 255),
-                'magenta': (255, 0, 255)
-            }
-            if color.lower() in color_map:
-                rgb_color = color_map[color.lower()]
-            elif color.startswith('#'):
-                # 处理十六进制颜色
-                rgb_color = tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
-            else:
-                try:
-                    rgb_color = ImageColor.getrgb(color)
-                except:
-                    rgb_color = (255, 255, 255)  # 默认白色
-        else:
-            rgb_color = (255, 255, 255)  # 默认白色
+        # 如果预览区域还没有初始化，使用更大的默认值
+        if preview_area_width <= 600 or preview_area_height <= 500:
+            preview_area_width = 800
+            preview_area_height = 600
         
-        # 应用透明度
-        opacity = self.watermark_settings['opacity'] / 100.0
-        color_with_opacity = rgb_color + (int(255 * opacity),)
-        
-        # 应用旋转
-        if self.watermark_settings['rotation'] != 0:
-            # 创建一个新的透明图层，大小足够容纳旋转后的文本
-            rotation_layer = Image.new('RGBA', (img.width * 2, img.height * 2), (0, 0, 0, 0))
-            rotation_draw = ImageDraw.Draw(rotation_layer)
-            
-            # 在中心位置绘制文本
-            center_x = rotation_layer.width // 2
-            center_y = rotation_layer.height // 2
-            
-            # 绘制阴影和描边效果
-            effects = self.watermark_settings['effects']
-            print(f"预览中的特效设置: {effects}")
-            if effects.get('shadow', False):
-                # 绘制阴影（偏移2像素，颜色为半透明黑色）
-                shadow_opacity = int(255 * opacity * 0.5)
-                shadow_color = (0, 0, 0, shadow_opacity)
-                print(f"绘制阴影效果，颜色: {shadow_color}")
-                rotation_draw.text((center_x + 2, center_y + 2), text, fill=shadow_color, font=font)
-            
-            if effects.get('outline', False):
-                # 绘制描边效果（在周围8个方向绘制黑色文本）
-                outline_opacity = int(255 * opacity)
-                outline_color = (0, 0, 0, outline_opacity)
-                print(f"绘制描边效果，颜色: {outline_color}")
-                for dx in [-1, 0, 1]:
-                    for dy in [-1, 0, 1]:
-                        if dx != 0 or dy != 0:
-                            rotation_draw.text((center_x + dx, center_y + dy), text, fill=outline_color, font=font)
-            
-            # 绘制主文本
-            rotation_draw.text((center_x, center_y), text, fill=color_with_opacity, font=font)
-            
-            # 旋转图层
-            rotated_layer = rotation_layer.rotate(-self.watermark_settings['rotation'], resample=Image.BICUBIC, expand=False)
-            
-            # 裁剪到原始大小并粘贴到水印图层
-            crop_left = (rotated_layer.width - img.width) // 2
-            crop_top = (rotated_layer.height - img.height) // 2
-            crop_right = crop_left + img.width
-            crop_bottom = crop_top + img.height
-            cropped_layer = rotated_layer.crop((crop_left, crop_top, crop_right, crop_bottom))
-            
-            # 将裁剪后的图层与水印图层合并
-            watermark_layer = Image.alpha_composite(watermark_layer, cropped_layer)
-        else:
-            # 绘制阴影和描边效果
-            effects = self.watermark_settings['effects']
-            print(f"预览中的特效设置(无旋转): {effects}")
-            if effects.get('shadow', False):
-                # 绘制阴影（偏移2像素，颜色为半透明黑色）
-                shadow_opacity = int(255 * opacity * 0.5)
-                shadow_color = (0, 0, 0, shadow_opacity)
-                print(f"绘制阴影效果(无旋转)，颜色: {shadow_color}")
-                draw.text((x + 2, y + 2), text, fill=shadow_color, font=font)
-            
-            if effects.get('outline', False):
-                # 绘制描边效果（在周围8个方向绘制黑色文本）
-                outline_opacity = int(255 * opacity)
-                outline_color = (0, 0, 0, outline_opacity)
-                print(f"绘制描边效果(无旋转)，颜色: {outline_color}")
-                for dx in [-1, 0, 1]:
-                    for dy in [-1, 0, 1]:
-                        if dx != 0 or dy != 0:
-                            draw.text((x + dx, y + dy), text, fill=outline_color, font=font)
-            
-            # 绘制主文本
-            draw.text((x, y), text, fill=color_with_opacity, font=font)
+        # 交给后台线程渲染，连续的设置变化会被合并
+        image_path = self.images[self.current_image_index]
+        self.preview_renderer.request(
+            image_path, WatermarkSpec.compile(self.watermark_settings),
+            preview_area_width, preview_area_height, high_quality
+        )
+    
+    def on_preview_rendered(self, qimg, original_size, scale_ratio):
+        # 转换为QPixmap并显示
+        pixmap = QPixmap.fromImage(qimg)
         
-        # 将水印图层与原图合成
-        result = Image.alpha_composite(img, watermark_layer)
+        # 设置pixmap并保持长宽比
+        self.preview_label.setPixmap(pixmap)
+        self.preview_label.setScaledContents(False)  # 关闭自动缩放以保持长宽比
+        self.preview_label.setAlignment(Qt.AlignCenter)  # 居中显示
         
-        # 将结果复制回原图
-        img.paste(result)
+        # 更新状态栏显示图片信息
+        if self.current_image_index != -1:
+            image_path = self.images[self.current_image_index]
+            scale_percent = int(scale_ratio * 100)
+            self.statusBar().showMessage(f'预览: {os.path.basename(image_path)} - 原始: {original_size[0]}×{original_size[1]} - 预览: {qimg.width()}×{qimg.height()} ({scale_percent}%)')
     
-    def apply_image_watermark_to_image(self, img):
-        """将图片水印应用到图像上"""
-        if not self.watermark_settings['image_path'] or not os.path.exists(self.watermark_settings['image_path']):
-            return
-        
-        try:
-            # 确保图像是RGBA模式
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            # 创建一个透明图层用于绘制水印
-            watermark_layer = Image.new('RGBA', img.size, (0, 0, 0, 0))
-            
-            # 打开水印图片
-            watermark = Image.open(self.watermark_settings['image_path']).convert("RGBA")
-            
-            # 调整水印大小
-            scale = self.watermark_settings['image_scale'] / 100.0
-            w = int(watermark.width * scale)
-            h = int(watermark.height * scale)
-            watermark = watermark.resize((w, h), Image.LANCZOS)
-            
-            # 应用透明度
-            opacity = self.watermark_settings['opacity'] / 100.0
-            if opacity < 1.0:
-                # 创建一个新的RGBA图像，调整alpha通道
-                watermark_data = watermark.getdata()
-                new_data = []
-                for item in watermark_data:
-                    # 调整alpha通道
-                    new_data.append((item[0], item[1], item[2], int(item[3] * opacity)))
-                watermark.putdata(new_data)
-            
-            # 应用旋转
-            if self.watermark_settings['rotation'] != 0:
-                # 使用透明背景进行旋转，确保旋转后的图像保持透明度
-                watermark = watermark.rotate(-self.watermark_settings['rotation'], expand=True, resample=Image.BICUBIC, fillcolor=(0,0,0,0))
-            
-            # 重新计算旋转后的尺寸
-            w, h = watermark.size
-            
-            # 计算位置
-            position = self.watermark_settings['position']
-            margin = 10
-            
-            if position == 'top_left':
-                x, y = margin, margin
-            elif position == 'top_center':
-                x, y = (img.width - w) // 2, margin
-            elif position == 'top_right':
-                x, y = img.width - w - margin, margin
-            elif position == 'middle_left':
-                x, y = margin, (img.height - h) // 2
-            elif position == 'center':
-                x, y = (img.width - w) // 2, (img.height - h) // 2
-            elif position == 'middle_right':
-                x, y = img.width - w - margin, (img.height - h) // 2
-            elif position == 'bottom_left':
-                x, y = margin, img.height - h - margin
-            elif position == 'bottom_center':
-                x, y = (img.width - w) // 2, img.height - h - margin
-            else:  # bottom_right
-                x, y = img.width - w - margin, img.height - h - margin
-            
-            # 将水印粘贴到透明图层上，使用水印自身作为mask确保透明度正确
-            watermark_layer.paste(watermark, (int(x), int(y)), watermark)
-            
-            # 将水印图层与原图合成
-            result = Image.alpha_composite(img, watermark_layer)
-            
-            # 将结果复制回原图
-            img.paste(result)
-            
-        except Exception as e:
-            print(f"Image watermark application error: {e}")
-            # 显示更详细的错误信息以便调试
-            import traceback
-            traceback.print_exc()
+    def on_preview_failed(self, message):
+        self.preview_label.setText(f"预览失败: {message}")
+        print(f"Preview error: {message}")
+        self.statusBar().showMessage('预览失败')
+    
+    def closeEvent(self, event):
+        # 停止后台预览线程、文件夹扫描和缩略图加载
+        if self.scan_worker is not None:
+            self.scan_worker.cancel()
+            self.scan_worker.wait()
+        self.preview_renderer.stop()
+        self.image_model.stop()
+        super().closeEvent(event)
     
     def export_images(self):
+        if self.export_worker is not None:
+            # 上一次导出尚未结束
+            return
+        
         if not self.images:
             QMessageBox.warning(self, "警告", "请先导入图片")
             return
@@ -1211,68 +1031,133 @@ class WatermarkApp(QMainWindow):
         os.makedirs(output_dir, exist_ok=True)
         
         # 获取命名规则
+        prefix = self.prefix_input.text()
+        suffix = self.suffix_input.text()
         if self.naming_original.isChecked():
             naming_rule = "original"
         elif self.naming_prefix.isChecked():
             naming_rule = "prefix"
-            prefix = self.prefix_input.text()
         else:
             naming_rule = "suffix"
-            suffix = self.suffix_input.text()
         
         # 获取输出格式
-        output_format = "JPEG" if self.format_jpeg.isChecked() else "PNG"
-        quality = self.quality_slider.value() if output_format == "JPEG" else None
-        
-        # 处理每张图片
-        processed_count = 0
+        if self.format_jpeg.isChecked():
+            output_format = "JPEG"
+        elif self.format_webp.isChecked():
+            output_format = "WEBP"
+        elif self.format_avif.isChecked():
+            output_format = "AVIF"
+        else:
+            output_format = "PNG"
+        quality = self.quality_slider.value() if output_format in watermark_core.LOSSY_FORMATS else None
+        profile = self.profile_combo.currentData()
+        
+        # 获取尺寸调整（水印在缩放后应用）
+        resize_mode = self.resize_mode_combo.currentData()
+        resize = {'mode': resize_mode, 'value': self.resize_value_spin.value()} if resize_mode else None
+        
+        # 为每张图片生成导出任务（设置编译为不可变的规格，导出过程中修改设置不影响本次导出）
+        spec = WatermarkSpec.compile(self.watermark_settings)
+        jobs = []
+        outputs = {}
+        conflicts = []
         for image_path in self.images:
-            try:
-                # 打开原图
-                img = Image.open(image_path)
-                
-                # 应用水印
-                if self.watermark_settings['type'] == 'text':
-                    self.apply_text_watermark_to_image(img)
-                else:
-                    self.apply_image_watermark_to_image(img)
-                
-                # 确定输出文件名
-                filename = os.path.basename(image_path)
-                name, ext = os.path.splitext(filename)
-                
-                if naming_rule == "original":
-                    output_filename = name
-                elif naming_rule == "prefix":
-                    output_filename = prefix + name
-                else:
-                    output_filename = name + suffix
-                
-                # 添加正确的扩展名
-                if output_format == "JPEG":
-                    output_filename += ".jpg"
-                else:
-                    output_filename += ".png"
-                
-                # 保存图片
-                output_path = os.path.join(output_dir, output_filename)
-                if output_format == "JPEG":
-                    img = img.convert("RGB")  # JPEG不支持透明通道
-                    img.save(output_path, format=output_format, quality=quality)
-                else:
-                    img.save(output_path, format=output_format)
-                
-                processed_count += 1
-                
-            except Exception as e:
-                print(f"Error processing {image_path}: {e}")
+            output_filename = watermark_core.build_output_filename(
+                image_path, naming_rule, prefix, suffix, output_format
+            )
+            # 从文件夹导入的图片保留子目录结构，不同子目录中的同名图片不会互相覆盖
+            output_path = os.path.join(output_dir, os.path.dirname(self.images.relative_path(image_path)),
+                                       output_filename)
+            key = watermark_core.output_key(output_path)
+            if key in outputs:
+                conflicts.append((outputs[key], image_path))
+                continue
+            outputs[key] = image_path
+            jobs.append({
+                'image_path': image_path,
+                'output_path': output_path,
+                'spec': spec,
+                'output_format': output_format,
+                'quality': quality,
+                'resize': resize,
+                'profile': profile
+            })
+        
+        if conflicts:
+            # 不同来源的同名图片（如分别导入的两个文件夹中）会输出到同一文件
+            details = "\n".join(f"{first}\n{second}" for first, second in conflicts[:10])
+            if len(conflicts) > 10:
+                details += f"\n... 等 {len(conflicts)} 组"
+            QMessageBox.warning(self, "警告", f"以下图片将输出到同一文件，请修改命名规则或移除重复的图片:\n{details}")
+            return
         
-        if processed_count > 0:
-            QMessageBox.information(self, "成功", f"已成功导出 {processed_count} 张图片到 {output_dir}")
+        # 进度对话框，支持取消
+        self.export_progress = QProgressDialog("正在导出图片...", "取消", 0, len(jobs), self)
+        self.export_progress.setWindowTitle("导出")
+        self.export_progress.setWindowModality(Qt.WindowModal)
+        self.export_progress.setMinimumDuration(0)
+        self.export_progress.setValue(0)
+        
+        self.export_errors = []
+        self.export_output_dir = output_dir
+        self.export_btn.setEnabled(False)
+        
+        # 在后台线程中按所选引擎（分阶段流水线或进程池）导出
+        # 输出目录中的导出清单使重复导出只处理新增或变化的图片
+        self.export_worker = BatchExportWorker(jobs, output_dir=output_dir,
+                                               engine=self.engine_combo.currentData(), parent=self)
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.file_failed.connect(self.on_export_file_failed)
+        self.export_worker.finished_export.connect(self.on_export_finished)
+        self.export_progress.canceled.connect(self.export_worker.cancel)
+        self.export_worker.start()
+    
+    def on_export_progress(self, done, total, image_path):
+        if self.export_worker is None:
+            return  # 批次已结束，不再用进度覆盖状态栏中的导出结果
+        self.statusBar().showMessage(f'导出进度: {done}/{total}')
+        self.export_progress.setLabelText(f"正在导出图片... ({done}/{total})\n{os.path.basename(image_path)}")
+        # 模态进度对话框的setValue会处理事件，完成信号可能在其中被处理，因此放在最后
+        self.export_progress.setValue(done)
+    
+    def on_export_file_failed(self, image_path, message):
+        self.export_errors.append((image_path, message))
+        print(f"Error processing {image_path}: {message}")
+    
+    def on_export_finished(self, succeeded, failed, skipped, cancelled):
+        self.export_progress.close()
+        self.export_btn.setEnabled(True)
+        self.export_worker.wait()
+        # 本批各阶段累计耗时、写出的文件大小和流水线各阶段利用率，显示在状态栏
+        report = self.export_worker.report.format()
+        timing_text = f' | 耗时: {report}' if report else ''
+        outputs = self.export_worker.report.format_outputs()
+        if outputs:
+            timing_text += f' | 输出: {outputs}'
+        if self.export_worker.stage_stats:
+            timing_text += f' | 流水线: {instrumentation.format_utilisation(self.export_worker.stage_stats)}'
+        self.export_worker.deleteLater()
+        self.export_worker = None
+        
+        output_dir = self.export_output_dir
+        skipped_text = f"，{skipped} 张未变化已跳过" if skipped else ""
+        if cancelled:
+            self.statusBar().showMessage(f'导出已取消: 已导出 {succeeded} 张{timing_text}')
+            QMessageBox.information(self, "已取消", f"导出已取消，已导出 {succeeded} 张图片到 {output_dir}{skipped_text}\n再次导出将从中断处继续")
+        elif failed:
+            # 列出失败的文件（最多显示10个）
+            details = "\n".join(f"{os.path.basename(p)}: {m}" for p, m in self.export_errors[:10])
+            if len(self.export_errors) > 10:
+                details += f"\n... 等 {len(self.export_errors)} 个文件"
+            self.statusBar().showMessage(f'导出完成: 成功 {succeeded} 张, 失败 {failed} 张, 跳过 {skipped} 张{timing_text}')
+            QMessageBox.warning(self, "警告", f"已导出 {succeeded} 张图片到 {output_dir}{skipped_text}，{failed} 张失败:\n{details}")
         else:
-            QMessageBox.warning(self, "警告", "导出过程中出现错误，未能成功导出图片")
+            self.statusBar().showMessage(f'导出完成: {succeeded} 张, 跳过 {skipped} 张{timing_text}')
+            QMessageBox.information(self, "成功", f"已成功导出 {succeeded} 张图片到 {output_dir}{skipped_text}")
 
 if __name__ == "__main__":
+    # 打包为exe后，进程池的子进程需要freeze_support
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = WatermarkApp()
     window.show()
@@ -0,0 +1,121 @@
+import os
+import sys
+import threading
+from collections import deque
+
+import tiled_processing
+import watermark_core
+
+# 内存感知调度 - 只读取文件头得到尺寸、模式和位深，估计每个导出任务的内存占用，
+# 按内存预算准入：小图可以同时处理很多张，超大图像则逐张处理，避免多张大图同时解码导致内存耗尽
+
+# 无法获取物理内存大小时使用的默认预算
+FALLBACK_RAM_BUDGET = 2 * 1024 * 1024 * 1024
+
+# 各模式每个通道的字节数（未列出的模式为1）
+BAND_BYTES = {'I': 4, 'F': 4, 'I;16': 2, 'I;16B': 2, 'I;16L': 2, 'I;16N': 2}
+
+
+def physical_memory():
+    """物理内存大小（字节），无法获取时返回None"""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                            ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                            ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                            ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                            ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            return status.ullTotalPhys
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_ram_budget():
+    """默认内存预算：物理内存的一半"""
+    total = physical_memory()
+    return total // 2 if total else FALLBACK_RAM_BUDGET
+
+
+def estimate_job_memory(job):
+    """只读取文件头，估计导出任务的内存占用（字节）
+
+    读入的文件内容 + 解码后的图像 + 编码时的格式转换副本 + 编码输出；
+    超出单张预算而走分块处理的图像只需一个条带的内存；
+    缩小输出的JPEG在解码时已按比例缩小，另加缩放结果
+    """
+    file_size = os.path.getsize(job['image_path'])
+    with tiled_processing.open_header(job['image_path']) as img:
+        width, height = img.size
+        image_format = img.format
+        mode = img.mode
+        bands = len(img.getbands())
+    pixel_bytes = bands * BAND_BYTES.get(mode, 1)
+
+    resize = job.get('resize')
+    memory_budget = job.get('memory_budget', tiled_processing.DEFAULT_MEMORY_BUDGET)
+    if not resize and memory_budget is not None and width * height * 4 > memory_budget:
+        return memory_budget + file_size
+
+    out_width, out_height = watermark_core.target_size(width, height, resize)
+    decoded_width, decoded_height = watermark_core.draft_size(width, height, image_format, (out_width, out_height))
+    estimate = file_size * 2 + decoded_width * decoded_height * pixel_bytes
+    if (out_width, out_height) != (width, height):
+        estimate += out_width * out_height * max(pixel_bytes, 3)
+    if mode in watermark_core.CONVERTED_MODES:
+        # 合成水印前转换为RGB(A)
+        estimate += decoded_width * decoded_height * 4
+        mode = 'RGB'
+    if mode not in watermark_core.OUTPUT_MODES.get(job['output_format'], (mode,)):
+        estimate += out_width * out_height * 4
+    return estimate
+
+
+class MemoryGate:
+    """按内存预算准入任务（先到先准入）
+
+    单个任务超出预算时等到没有其它任务在运行再准入，即超大图像逐张处理
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.in_use = 0
+        self.peak = 0  # 预留内存的峰值
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._cancelled = False
+
+    def acquire(self, size):
+        """阻塞直到可以准入，返回预留的字节数；已取消时返回None"""
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while not self._cancelled:
+                    if self._queue[0] is ticket and (self.in_use == 0 or self.in_use + size <= self.budget):
+                        self.in_use += size
+                        self.peak = max(self.peak, self.in_use)
+                        return size
+                    self._cond.wait()
+                return None
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self, size):
+        with self._cond:
+            self.in_use -= size
+            self._cond.notify_all()
+
+    def cancel(self):
+        """唤醒所有等待中的任务并拒绝准入"""
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
@@ -0,0 +1,75 @@
+import os
+import threading
+from collections import OrderedDict
+
+# 预览底图缓存 - 缓存已缩小到预览尺寸的原图（底图代理），
+# 设置变化时只需重新渲染水印层，预览开销不再随原图像素数增长
+
+# 默认内存预算：256MB
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+
+class BaseProxy:
+    """已缩放到预览尺寸的RGBA底图"""
+
+    def __init__(self, image, original_size, scale_ratio, high_quality):
+        self.image = image
+        self.original_size = original_size
+        self.scale_ratio = scale_ratio
+        self.high_quality = high_quality  # 快速预览生成的底图在空闲后会被高质量底图替换
+
+    @property
+    def nbytes(self):
+        return self.image.width * self.image.height * len(self.image.getbands())
+
+
+class PreviewCache:
+    """按(路径, 修改时间, 预览区域尺寸)索引、按内存预算淘汰的LRU缓存"""
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_path, area_width, area_height):
+        # 修改时间参与索引，文件被修改后旧缓存自然失效
+        return (os.path.abspath(image_path), os.path.getmtime(image_path), area_width, area_height)
+
+    def get(self, key):
+        with self._lock:
+            proxy = self._entries.get(key)
+            if proxy is not None:
+                self._entries.move_to_end(key)
+            return proxy
+
+    def put(self, key, proxy):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old.nbytes
+
+            # 单张超出预算时不缓存
+            if proxy.nbytes > self.budget_bytes:
+                return
+
+            self._entries[key] = proxy
+            self._total_bytes += proxy.nbytes
+
+            # 淘汰最久未使用的底图直到满足预算
+            while self._total_bytes > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
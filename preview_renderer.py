@@ -0,0 +1,201 @@
+import threading
+from PySide6.QtCore import QObject, QThread, QTimer, Signal
+from PySide6.QtGui import QImage
+from PIL import Image
+
+import font_registry
+from preview_cache import BaseProxy, PreviewCache
+
+# 后台预览渲染 - 合并连续的设置变化，丢弃过期的渲染结果，
+# 拖动时先显示快速低质量预览，输入停止后再渲染高质量预览
+
+# 输入停止多久后渲染高质量预览（毫秒）
+HQ_IDLE_DELAY_MS = 250
+
+
+def compute_preview_size(img_width, img_height, area_width, area_height):
+    """计算保持长宽比的预览尺寸，返回(预览宽, 预览高, 缩放比例)"""
+    width_ratio = area_width / img_width
+    height_ratio = area_height / img_height
+    scale_ratio = min(width_ratio, height_ratio)  # 选择较小的比例以确保图片完全显示
+
+    # 如果图片很小，允许适度放大但不超过2倍
+    if scale_ratio > 2.0:
+        scale_ratio = 2.0
+
+    return int(img_width * scale_ratio), int(img_height * scale_ratio), scale_ratio
+
+
+def load_base_proxy(image_path, area_width, area_height, fast=False):
+    """解码原图并缩小到预览尺寸，生成底图代理
+
+    fast=True时使用JPEG降采样解码和双线性缩放，用于拖动滑块时的快速预览
+    """
+    img = Image.open(image_path)
+    original_size = img.size
+    preview_width, preview_height, scale_ratio = compute_preview_size(
+        img.width, img.height, area_width, area_height
+    )
+
+    if fast:
+        # JPEG可直接以较低分辨率解码，大幅减少解码开销
+        img.draft('RGB', (preview_width, preview_height))
+        img = img.convert("RGBA")
+        preview_img = img.resize((preview_width, preview_height), Image.Resampling.BILINEAR)
+    else:
+        img = img.convert("RGBA")  # 确保图像是RGBA模式
+        if scale_ratio < 1.0:
+            # 缩小时使用LANCZOS
+            preview_img = img.resize((preview_width, preview_height), Image.Resampling.LANCZOS)
+        else:
+            # 放大时使用BICUBIC
+            preview_img = img.resize((preview_width, preview_height), Image.Resampling.BICUBIC)
+
+    return BaseProxy(preview_img, original_size, scale_ratio, high_quality=not fast)
+
+
+def render_preview(image_path, spec, area_width, area_height, fast=False, cache=None):
+    """渲染带水印的预览图，返回(预览图, 原图尺寸, 缩放比例)
+
+    提供cache时复用已缓存的底图代理，只重新渲染水印层
+    """
+    proxy = None
+    if cache is not None:
+        key = PreviewCache.make_key(image_path, area_width, area_height)
+        proxy = cache.get(key)
+        # 快速底图只用于快速预览，高质量预览需要重新生成
+        if proxy is not None and not fast and not proxy.high_quality:
+            proxy = None
+
+    if proxy is None:
+        proxy = load_base_proxy(image_path, area_width, area_height, fast)
+        if cache is not None:
+            cache.put(key, proxy)
+
+    # 在底图副本上应用水印，底图本身保持不变
+    preview_img = proxy.image.copy()
+    spec.apply(preview_img)
+
+    return preview_img, proxy.original_size, proxy.scale_ratio
+
+
+class PreviewWorker(QThread):
+    """预览渲染线程：只保留最新的一个请求，旧请求直接丢弃"""
+
+    # 请求编号, 预览图, 原图尺寸(宽, 高), 缩放比例
+    rendered = Signal(int, QImage, tuple, float)
+    # 请求编号, 错误信息
+    failed = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._condition = threading.Condition()
+        self._pending = None
+        self._latest_generation = 0
+        self._running = True
+        # 底图缓存只在本线程中使用
+        self.cache = PreviewCache()
+
+    def submit(self, generation, request):
+        with self._condition:
+            # 覆盖尚未开始的旧请求，实现合并
+            self._pending = (generation, request)
+            self._latest_generation = generation
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self.wait()
+
+    def _is_stale(self, generation):
+        with self._condition:
+            return generation != self._latest_generation
+
+    def run(self):
+        # 在后台预先扫描系统字体，避免首次预览时等待
+        font_registry.discover()
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                generation, request = self._pending
+                self._pending = None
+
+            try:
+                preview_img, original_size, scale_ratio = render_preview(cache=self.cache, **request)
+            except Exception as e:
+                if not self._is_stale(generation):
+                    self.failed.emit(generation, str(e))
+                continue
+
+            # 渲染期间已有新请求，丢弃本次结果
+            if self._is_stale(generation):
+                continue
+
+            data = preview_img.tobytes("raw", "RGBA")
+            # copy()使QImage拥有自己的数据，可安全跨线程传递
+            qimg = QImage(data, preview_img.width, preview_img.height,
+                          preview_img.width * 4, QImage.Format_RGBA8888).copy()
+            self.rendered.emit(generation, qimg, original_size, scale_ratio)
+
+
+class PreviewRenderer(QObject):
+    """预览调度器：每次请求立即渲染快速预览，输入停止后补一帧高质量预览"""
+
+    rendered = Signal(QImage, tuple, float)
+    failed = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._generation = 0
+        self._last_request = None
+
+        self._worker = PreviewWorker()
+        self._worker.rendered.connect(self._on_rendered)
+        self._worker.failed.connect(self._on_failed)
+        self._worker.start()
+
+        self._hq_timer = QTimer(self)
+        self._hq_timer.setSingleShot(True)
+        self._hq_timer.setInterval(HQ_IDLE_DELAY_MS)
+        self._hq_timer.timeout.connect(self._request_high_quality)
+
+    def request(self, image_path, spec, area_width, area_height, high_quality=False):
+        """请求渲染预览；high_quality=True时跳过快速预览直接渲染高质量预览"""
+        self._last_request = {
+            'image_path': image_path,
+            'spec': spec,  # 编译后的规格不可变，可直接与工作线程共享
+            'area_width': area_width,
+            'area_height': area_height
+        }
+        if high_quality:
+            self._hq_timer.stop()
+            self._submit(fast=False)
+        else:
+            self._submit(fast=True)
+            self._hq_timer.start()
+
+    def stop(self):
+        self._hq_timer.stop()
+        self._worker.stop()
+
+    def _request_high_quality(self):
+        if self._last_request is not None:
+            self._submit(fast=False)
+
+    def _submit(self, fast):
+        self._generation += 1
+        self._worker.submit(self._generation, dict(self._last_request, fast=fast))
+
+    def _on_rendered(self, generation, qimg, original_size, scale_ratio):
+        # 信号在队列中等待时可能已有更新的请求
+        if generation == self._generation:
+            self.rendered.emit(qimg, original_size, scale_ratio)
+
+    def _on_failed(self, generation, message):
+        if generation == self._generation:
+            self.failed.emit(message)
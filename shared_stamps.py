@@ -0,0 +1,102 @@
+import atexit
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+from PIL import Image
+
+# 共享内存图章 - 多进程导出时父进程把预先渲染好的水印图章（图片水印、旋转的文字水印、平铺图案单元）
+# 写入共享内存一次，任务中只携带几十字节的句柄；子进程按句柄映射同一块内存，
+# 直接作为图层合成，不复制像素，也不再从磁盘读取和缩放水印图片
+
+
+class SpriteHandle(NamedTuple):
+    """共享内存中的一个图章"""
+
+    name: str  # 共享内存块名称
+    size: tuple  # (宽, 高)
+    mode: str = 'RGBA'
+
+
+class StampPublisher:
+    """在父进程中发布图章，with块结束（批次完成、中断或出错）时释放全部共享内存
+
+    with StampPublisher() as publisher:
+        job['spec'] = publisher.publish(job['spec'])
+    """
+
+    def __init__(self):
+        self._segments = []
+        self._published = {}  # 原规格 -> 带句柄的规格（同一规格只发布一次）
+
+    def publish(self, spec):
+        """返回带共享图章句柄的规格；图章依赖图像尺寸（不旋转的文字水印）或无法创建共享内存时返回原规格"""
+        if spec.sprite is not None:
+            return spec
+        if spec in self._published:
+            return self._published[spec]
+
+        published = spec
+        try:
+            layer = spec.shareable_layer()
+        except Exception:
+            layer = None  # 渲染失败（如水印图片损坏）时由子进程渲染并报告错误
+        if layer is not None:
+            data = layer.tobytes()
+            try:
+                segment = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+            except OSError:
+                segment = None  # 没有可用的共享内存（如/dev/shm不可用），子进程自行渲染
+            if segment is not None:
+                self._segments.append(segment)
+                segment.buf[:len(data)] = data
+                published = spec._replace(sprite=SpriteHandle(segment.name, layer.size, layer.mode))
+        self._published[spec] = published
+        return published
+
+    def close(self):
+        """释放所有共享内存块；已映射的子进程中的图章在其映射解除前仍然有效"""
+        for segment in self._segments:
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self._segments = []
+        self._published = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+# 子进程中已映射的共享内存块：名称 -> (共享内存, 图层)；映射保持到进程退出
+_attached = {}
+
+
+@atexit.register
+def _detach_all():
+    """进程退出前先关闭图层再解除映射（图层仍引用共享内存时无法解除映射）"""
+    for segment, layer in _attached.values():
+        layer.close()
+        try:
+            segment.close()
+        except BufferError:
+            pass  # 图层仍被其它对象引用，映射随进程退出解除
+    _attached.clear()
+
+
+def attach(handle):
+    """按句柄映射共享内存中的图章，返回只读的图层（与共享内存共用像素，不复制）"""
+    entry = _attached.get(handle.name)
+    if entry is None:
+        try:
+            # Python 3.13起可以不向资源跟踪进程登记，共享内存块只由发布者释放
+            segment = shared_memory.SharedMemory(name=handle.name, track=False)
+        except TypeError:
+            segment = shared_memory.SharedMemory(name=handle.name)
+        layer = Image.frombuffer(handle.mode, handle.size, segment.buf, 'raw', handle.mode, 0, 1)
+        entry = _attached[handle.name] = (segment, layer)
+    return entry[1]
@@ -0,0 +1,92 @@
+import functools
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# 图章缓存 - 文字图章、图片水印图章和平铺图案可能是接近整幅大小的RGBA图层，
+# 按条目数限制时拖动缩放或旋转滑块就会留下几十个大图层；所有图章共用一个按字节数淘汰的LRU缓存
+
+# 默认内存预算：128MB
+DEFAULT_BUDGET_BYTES = 128 * 1024 * 1024
+
+# 每个条目的额外计数（键和元组本身），没有图像的结果（如空文本）也会被淘汰
+ENTRY_OVERHEAD_BYTES = 256
+
+_MISSING = object()
+
+
+def value_nbytes(value):
+    """缓存值中所有图像占用的字节数"""
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, tuple):
+        return sum(value_nbytes(item) for item in value)
+    return 0
+
+
+class StampCache:
+    """按内存预算淘汰的LRU缓存（线程安全），单个结果超出预算时不缓存"""
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # 键 -> (值, 字节数)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = value_nbytes(value) + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            if nbytes > self.budget_bytes:
+                return
+
+            self._entries[key] = (value, nbytes)
+            self._total_bytes += nbytes
+            # 淘汰最久未使用的图章直到满足预算
+            while self._total_bytes > self.budget_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 进程内所有图章共用的缓存
+stamps = StampCache()
+
+
+def cached(func):
+    """按参数把func的结果缓存在stamps中（参数须可哈希）；cache_clear()清空整个图章缓存"""
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        value = stamps.get(key, _MISSING)
+        if value is _MISSING:
+            value = func(*args, **kwargs)
+            stamps.put(key, value)
+        return value
+
+    wrapper.cache_clear = stamps.clear
+    return wrapper
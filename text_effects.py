@@ -0,0 +1,55 @@
+import math
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+# 文本特效管线 - 字形只光栅化一次得到蒙版，阴影、描边、发光都由该蒙版派生，
+# 每种特效只需一次滤镜运算，而不是多次调用draw.text
+
+
+def render_glyph_mask(text, font, frac_x=0.0, frac_y=0.0, padding=0):
+    """光栅化文本字形蒙版（L模式），返回(蒙版, 左偏移, 上偏移)
+
+    偏移为蒙版左上角相对文本起点的整数位置；frac_x/frac_y为起点的小数部分（影响抗锯齿）
+    """
+    draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+    ink = draw.textbbox((frac_x, frac_y), text, font=font)
+    left = math.floor(ink[0]) - padding
+    top = math.floor(ink[1]) - padding
+    mask = Image.new('L', (math.ceil(ink[2]) + padding - left, math.ceil(ink[3]) + padding - top), 0)
+    ImageDraw.Draw(mask).text((frac_x - left, frac_y - top), text, fill=255, font=font)
+    return mask, left, top
+
+
+def render_text_effects(text, font, fill, shadow_color=None, outline_color=None, glow_color=None,
+                        frac_x=0.0, frac_y=0.0, shadow_offset=2, shadow_blur=0, glow_radius=0):
+    """渲染带特效的文本图层（RGBA），返回(图层, 左偏移, 上偏移)
+
+    各颜色为RGBA元组，为None时不绘制该特效；从下到上依次为发光、阴影、描边、文本
+    """
+    # 为阴影偏移和模糊留出足够的边距
+    padding = 3
+    if shadow_color is not None:
+        padding += shadow_offset + math.ceil(shadow_blur * 3)
+    if glow_color is not None:
+        padding = max(padding, 3 + math.ceil(glow_radius * 3))
+
+    mask, left, top = render_glyph_mask(text, font, frac_x, frac_y, padding)
+    layer = Image.new('RGBA', mask.size, (0, 0, 0, 0))
+
+    if glow_color is not None:
+        # 柔和发光：对字形蒙版做一次高斯模糊
+        layer.paste(glow_color, mask=mask.filter(ImageFilter.GaussianBlur(glow_radius)))
+
+    if shadow_color is not None:
+        # 阴影：平移字形蒙版（边距保证平移不会卷回字形），可选模糊
+        shadow_mask = ImageChops.offset(mask, shadow_offset, shadow_offset)
+        if shadow_blur:
+            shadow_mask = shadow_mask.filter(ImageFilter.GaussianBlur(shadow_blur))
+        layer.paste(shadow_color, mask=shadow_mask)
+
+    if outline_color is not None:
+        # 描边：3x3最大值滤波即向四周膨胀1像素
+        layer.paste(outline_color, mask=mask.filter(ImageFilter.MaxFilter(3)))
+
+    # 文本本身
+    layer.paste(fill, mask=mask)
+    return layer, left, top
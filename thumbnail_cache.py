@@ -0,0 +1,100 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QImage
+from PIL import Image
+
+import user_cache
+
+# 缩略图管线 - 在线程池中以降采样方式解码生成缩略图，并缓存到磁盘，
+# 再次导入同一文件时直接读取缓存
+
+THUMBNAIL_SIZE = 80
+
+# 缩略图缓存目录（当前用户的缓存目录）
+CACHE_DIR = user_cache.cache_dir("thumbnails")
+
+# 缓存上限：总大小和未使用的时间，启动时清理
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_MAX_AGE = 60 * 24 * 3600
+
+
+def cache_path(image_path, size=THUMBNAIL_SIZE):
+    """根据(路径, 尺寸, 修改时间)生成缓存文件路径"""
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{size}|{stat.st_mtime_ns}|{stat.st_size}"
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".png")
+
+
+def make_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """生成RGBA缩略图：JPEG使用draft()按1/2~1/8比例解码，其余格式用reduce()快速缩小后再重采样"""
+    img = Image.open(image_path)
+    img.draft('RGB', (size, size))
+    img.thumbnail((size, size), reducing_gap=2.0)
+    return img.convert("RGBA")
+
+
+def load_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """读取缓存的缩略图，没有缓存时生成并写入缓存"""
+    thumb_path = cache_path(image_path, size)
+    if os.path.exists(thumb_path):
+        try:
+            img = Image.open(thumb_path).convert("RGBA")
+        except Exception:
+            pass  # 缓存文件损坏，重新生成
+        else:
+            try:
+                os.utime(thumb_path)  # 修改时间记录最近一次使用，清理时先删除最久未用的
+            except OSError:
+                pass
+            return img
+
+    img = make_thumbnail(image_path, size)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # 先写临时文件再替换，避免并发读取到不完整的缓存
+        tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+        img.save(tmp_path, format="PNG")
+        os.replace(tmp_path, thumb_path)
+    except OSError as e:
+        print(f"Error writing thumbnail cache for {image_path}: {e}")
+    return img
+
+
+def prune_cache():
+    """按CACHE_MAX_BYTES和CACHE_MAX_AGE清理缩略图缓存，返回删除的文件数"""
+    return user_cache.prune_directory(CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE)
+
+
+class ThumbnailLoader(QObject):
+    """在线程池中加载缩略图，每完成一张即通过信号通知GUI"""
+
+    # 图片路径, 缩略图
+    thumbnail_ready = Signal(str, QImage)
+    # 图片路径, 错误信息
+    thumbnail_failed = Signal(str, str)
+
+    def __init__(self, max_workers=None, parent=None):
+        super().__init__(parent)
+        # Pillow解码时会释放GIL，线程池即可利用多核
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1))
+        # 在后台清理过期和超出大小上限的缓存
+        self._executor.submit(prune_cache)
+
+    def request(self, image_paths, size=THUMBNAIL_SIZE):
+        for path in image_paths:
+            self._executor.submit(self._load, path, size)
+
+    def stop(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load(self, image_path, size):
+        try:
+            img = load_thumbnail(image_path, size)
+            data = img.tobytes("raw", "RGBA")
+            # copy()使QImage拥有自己的数据，可安全跨线程传递
+            qimg = QImage(data, img.width, img.height, img.width * 4, QImage.Format_RGBA8888).copy()
+            self.thumbnail_ready.emit(image_path, qimg)
+        except Exception as e:
+            self.thumbnail_failed.emit(image_path, str(e))
@@ -0,0 +1,251 @@
+import os
+import shutil
+import struct
+import zlib
+from PIL import Image, UnidentifiedImageError
+
+import watermark_core
+
+# 超大图像分块处理 - 对未压缩的TIFF/BMP等格式直接按行读取像素数据，
+# 只解码与水印重叠的条带，输出以流式写入，内存峰值由预算决定而与原图尺寸无关
+
+# 默认内存预算（字节）
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# 可按行读写的像素模式
+SUPPORTED_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK')
+
+# PNG颜色类型
+PNG_COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+# 条带内每个像素的工作内存估计：条带本身 + 合成时的RGBA区域
+BAND_BYTES_PER_PIXEL = 8
+
+
+class TilingNotSupported(Exception):
+    """图像格式或输出格式不支持分块处理"""
+
+
+def open_header(image_path):
+    """打开图像只读取文件头
+
+    分块处理时内存由预算控制，因此不受Pillow解压炸弹像素上限的限制；
+    直接按Pillow注册的格式识别文件，不修改全局的Image.MAX_IMAGE_PIXELS
+    （多个线程同时打开文件头时临时修改全局值会关闭其它线程中解码时的检查）
+    """
+    with open(image_path, 'rb') as f:
+        prefix = f.read(16)
+    Image.init()
+    for format_id in Image.ID:
+        factory, accept = Image.OPEN[format_id]
+        result = accept is None or accept(prefix)
+        if not result or isinstance(result, str):  # 字符串为该格式不支持此文件的说明
+            continue
+        try:
+            return factory(image_path)
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue  # 与Image.open相同：文件头不符合该格式，尝试下一个
+    raise UnidentifiedImageError(f"cannot identify image file '{image_path}'")
+
+
+def estimate_working_set(image_path):
+    """只读取文件头，估计整图解码处理所需的内存（字节）"""
+    with open_header(image_path) as img:
+        return img.width * img.height * 4
+
+
+def needs_tiling(image_path, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """整图处理的内存估计超出预算时返回True"""
+    return memory_budget is not None and estimate_working_set(image_path) > memory_budget
+
+
+class RawRowReader:
+    """直接按行读写未压缩图像文件的像素数据
+
+    利用Pillow解析出的raw数据块描述(范围, 文件偏移, 原始模式, 行跨度, 方向)，
+    可只读取某几行而不解码整幅图像，并能将修改后的行写回到同样的位置
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open_header(path) as img:
+            self.format = img.format
+            self.mode = img.mode
+            self.size = img.size
+            tiles = list(img.tile)
+
+        if self.mode not in SUPPORTED_MODES:
+            raise TilingNotSupported(f"不支持分块处理的像素模式: {self.mode}")
+        if not tiles or any(tile[0] != 'raw' for tile in tiles):
+            raise TilingNotSupported(f"{self.format}文件经过压缩，无法按行读取")
+        if len({tile[1] for tile in tiles}) != len(tiles):
+            raise TilingNotSupported("不支持分平面存储的图像")
+
+        self.tiles = []
+        for _, extents, offset, args in tiles:
+            if isinstance(args, str):
+                args = (args,)
+            rawmode = args[0]
+            stride = args[1] if len(args) > 1 else 0
+            orientation = args[2] if len(args) > 2 else 1
+            x0, y0, x1, y1 = extents
+            row_bytes = len(Image.new(self.mode, (x1 - x0, 1)).tobytes('raw', rawmode))
+            self.tiles.append((extents, offset, rawmode, stride or row_bytes, orientation, row_bytes))
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def _row_offset(self, tile, y):
+        """第y行（图像坐标）在文件中的偏移"""
+        (x0, y0, x1, y1), offset, _, stride, orientation, _ = tile
+        row = y - y0 if orientation > 0 else y1 - 1 - y
+        return offset + row * stride
+
+    def read_band(self, f, top, bottom):
+        """读取[top, bottom)行，返回整行宽的图像"""
+        band = Image.new(self.mode, (self.width, bottom - top))
+        for tile in self.tiles:
+            (x0, y0, x1, y1), _, rawmode, stride, orientation, _ = tile
+            start, end = max(top, y0), min(bottom, y1)
+            if start >= end:
+                continue
+            # 所需的行在文件中连续存放（自下而上存储时从最后一行开始）
+            f.seek(self._row_offset(tile, start if orientation > 0 else end - 1))
+            data = f.read((end - start) * stride)
+            part = Image.frombytes(self.mode, (x1 - x0, end - start), data, 'raw',
+                                   rawmode, stride, orientation)
+            band.paste(part, (x0, start - top))
+        return band
+
+    def write_band(self, f, band, top):
+        """将band写回到从top行开始的位置（f须为可写的源文件副本）"""
+        bottom = top + band.height
+        for tile in self.tiles:
+            (x0, y0, x1, y1), _, rawmode, stride, orientation, row_bytes = tile
+            start, end = max(top, y0), min(bottom, y1)
+            if start >= end:
+                continue
+            data = band.crop((x0, start - top, x1, end - top)).tobytes('raw', rawmode)
+            if orientation > 0 and stride == row_bytes:
+                f.seek(self._row_offset(tile, start))
+                f.write(data)
+                continue
+            # 有行填充或自下而上存储时逐行写入，保留原文件中的填充字节
+            for i in range(end - start):
+                f.seek(self._row_offset(tile, start + i))
+                f.write(data[i * row_bytes:(i + 1) * row_bytes])
+
+
+def rows_per_band(width, memory_budget):
+    """在内存预算内每个条带可以处理的行数"""
+    return max(1, memory_budget // (width * BAND_BYTES_PER_PIXEL))
+
+
+def _composite_band(band, top, placements):
+    for layer, x, y in placements:
+        watermark_core.composite_onto(band, layer, x, y - top)
+
+
+def _overlapping_rows(placements, height):
+    """合并各水印覆盖的行区间"""
+    spans = sorted((max(0, y), min(height, y + layer.height)) for layer, x, y in placements)
+    merged = []
+    for start, end in spans:
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def patch_copy(reader, output_path, placements, memory_budget):
+    """复制源文件后只改写与水印重叠的行，输出格式与源文件相同"""
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(reader.path, tmp_path)
+        step = rows_per_band(reader.width, memory_budget)
+        with open(reader.path, 'rb') as src, open(tmp_path, 'r+b') as dst:
+            for start, end in _overlapping_rows(placements, reader.height):
+                for top in range(start, end, step):
+                    bottom = min(top + step, end)
+                    band = reader.read_band(src, top, bottom)
+                    _composite_band(band, top, placements)
+                    reader.write_band(dst, band, top)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _png_chunk(f, chunk_type, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+
+def stream_png(reader, output_path, placements, memory_budget, compress_level=6):
+    """逐条带读取、合成并压缩，流式写出PNG"""
+    mode = reader.mode if reader.mode in PNG_COLOR_TYPES else 'RGB'
+    width, height = reader.size
+    row_bytes = width * len(mode)
+    step = rows_per_band(width, memory_budget)
+    compressor = zlib.compressobj(compress_level)
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(reader.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            dst.write(b'\x89PNG\r\n\x1a\n')
+            _png_chunk(dst, b'IHDR', struct.pack('>IIBBBBB', width, height, 8,
+                                                 PNG_COLOR_TYPES[mode], 0, 0, 0))
+            for top in range(0, height, step):
+                bottom = min(top + step, height)
+                band = reader.read_band(src, top, bottom)
+                _composite_band(band, top, placements)
+                if band.mode != mode:
+                    band = band.convert(mode)
+                data = band.tobytes()
+                del band
+                # 每行前加过滤类型0（不过滤）
+                rows = bytearray()
+                for i in range(bottom - top):
+                    rows.append(0)
+                    rows += data[i * row_bytes:(i + 1) * row_bytes]
+                compressed = compressor.compress(bytes(rows))
+                if compressed:
+                    _png_chunk(dst, b'IDAT', compressed)
+            _png_chunk(dst, b'IDAT', compressor.flush())
+            _png_chunk(dst, b'IEND', b'')
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def export_image_tiled(job, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """分块导出单张图片，参数与watermark_core.export_image相同
+
+    输出为PNG时按编码档位的压缩级别流式编码；输出格式与源文件相同且编码档位不要求压缩时
+    复制后只改写水印区域；其它情况（如JPEG编码器需要整幅图像）抛出TilingNotSupported
+    """
+    reader = RawRowReader(job['image_path'])
+    output_format = job['output_format']
+    options = watermark_core.encoder_options(output_format, job.get('profile'))
+    if output_format != 'PNG' and output_format != reader.format:
+        raise TilingNotSupported(f"{output_format}输出需要整幅图像")
+    if output_format != 'PNG' and options.get('compression'):
+        raise TilingNotSupported(f"压缩的{output_format}输出需要整幅图像")
+
+    placements = job['spec'].placements(reader.width, reader.height)
+    if output_format == 'PNG':
+        stream_png(reader, job['output_path'], placements, memory_budget, options['compress_level'])
+    else:
+        patch_copy(reader, job['output_path'], placements, memory_budget)
+    return job['output_path']
@@ -0,0 +1,61 @@
+import os
+import time
+import platform
+
+# 用户缓存目录 - 缩略图和EXIF索引等可随时重建的数据放在当前用户的缓存目录中，
+# 程序安装在只读位置时也能写入；各缓存按大小和存放时间清理，不会无限增长
+
+APP_NAME = "watermark"
+
+# 通过环境变量指定缓存目录（如便携版放在程序旁边）
+ENV_VAR = 'WATERMARK_CACHE_DIR'
+
+
+def cache_dir(*parts):
+    """当前用户的缓存目录（不创建）：Windows为%LOCALAPPDATA%，macOS为~/Library/Caches，其余为$XDG_CACHE_HOME或~/.cache"""
+    root = os.environ.get(ENV_VAR)
+    if not root:
+        system = platform.system()
+        if system == 'Windows':
+            base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+            root = os.path.join(base, APP_NAME, 'cache')
+        elif system == 'Darwin':  # macOS
+            root = os.path.join(os.path.expanduser('~/Library/Caches'), APP_NAME)
+        else:
+            root = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), APP_NAME)
+    return os.path.join(root, *parts)
+
+
+def prune_directory(directory, max_bytes, max_age):
+    """删除目录中超过max_age秒未使用（按修改时间）的文件，再从最久未使用的开始删除直到总大小不超过max_bytes
+
+    返回删除的文件数；目录不存在时返回0
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+
+    files = []
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    cutoff = time.time() - max_age
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # 其它进程正在使用或已删除
+        total -= size
+        removed += 1
+    return removed
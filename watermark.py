@@ -1,86 +1,523 @@
 import argparse
+import json
 import os
-from PIL import Image, ImageDraw, ImageFont, ExifTags
+import sys
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+import exif_index
+import export_manifest
+import export_pipeline
+import memory_scheduler
+import shared_stamps
+import font_registry
+import instrumentation
+import tiled_processing
+import watermark_core
+from watermark_spec import PATTERN_POSITION, WatermarkSpec
+from folder_scanner import scan_images
+
+# 无界面批量水印命令行工具 - 参数全部来自命令行或任务文件（与GUI模板格式相同），
+# 使用与GUI相同的渲染核心，可多进程并行，适合定时任务和自动化流程调用
+
+POSITIONS = ['top_left', 'top_center', 'top_right',
+             'middle_left', 'center', 'middle_right',
+             'bottom_left', 'bottom_center', 'bottom_right', PATTERN_POSITION]
+
+# 未提供任务文件时的水印设置（键与GUI模板相同）；text为None时使用拍摄日期
+DEFAULT_SETTINGS = {
+    'type': 'text',
+    'text': None,
+    'font': 'Arial',
+    'font_size': 50,
+    'color': 'white',
+    'opacity': 100,
+    'position': 'bottom_right',
+    'rotation': 0,
+    'effects': {
+        'shadow': False,
+        'outline': False,
+        'glow': False
+    },
+    'image_path': '',
+    'image_scale': 100,
+    'pattern': {
+        'spacing': 100,
+        'stagger': 50
+    }
+}
+
 
 def get_exif_date(image_path):
+    """读取单张图片的拍摄日期（只解析文件头部的EXIF数据）"""
     try:
-        img = Image.open(image_path)
-        exif_data = img._getexif()
-        if exif_data:
-            for tag, value in exif_data.items():
-                tag_name = ExifTags.TAGS.get(tag, tag)
-                if tag_name == 'DateTimeOriginal':
-                    return value.split(' ')[0].replace(':', '-')
+        return exif_index.capture_date(exif_index.read_exif_tags(image_path))
     except Exception as e:
-        print(f"Error reading EXIF data for {os.path.basename(image_path)}: {e}")
+        print(f"Error reading EXIF data for {os.path.basename(image_path)}: {e}", file=sys.stderr)
     return None
 
-def main():
-    parser = argparse.ArgumentParser(description='为图片批量添加水印。')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='为图片批量添加水印（无交互，可用于脚本和定时任务）。')
+    parser.add_argument('inputs', nargs='+', help='图片文件或目录，可指定多个。')
+    parser.add_argument('-o', '--output', type=str,
+                        help='输出目录。只有一个输入目录时默认为 <目录>/<目录名>_watermark。')
+    parser.add_argument('--spec', type=str,
+                        help='任务文件（GUI保存的模板JSON）；命令行参数会覆盖其中的同名设置。')
     parser.add_argument('--text', type=str, help='自定义水印文本。如果未提供，则尝试读取拍摄日期。')
-    parser.add_argument('--font_size', type=int, default=50, help='水印字体大小，默认为 50。')
-    parser.add_argument('--color', type=str, default='white', help='水印颜色，默认为 \'white\'。')
-    parser.add_argument('--position', type=str, default='bottom_right', 
-                        choices=['top_left', 'top_right', 'bottom_left', 'bottom_right', 'center'],
-                        help='水印位置，默认为右下角 (bottom_right)。')
-    args = parser.parse_args()
-
-    image_dir = input("请输入图片所在目录的路径: ")
-
-    if not os.path.isdir(image_dir):
-        print(f"错误: \'{image_dir}\' 不是一个有效的目录。")
-        return
-
-    image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    
-    if not image_files:
-        print("目录中未找到任何图片文件。")
-        return
-
-    for image_file in image_files:
-        image_path = os.path.join(image_dir, image_file)
-        
-        watermark_text = args.text
-        if not watermark_text:
-            watermark_text = get_exif_date(image_path)
-        
-        if not watermark_text:
-            print(f"无法获取 \'{image_file}\' 的水印文本，已跳过。")
-            continue
-
-        img = Image.open(image_path)
-        draw = ImageDraw.Draw(img)
-        
+    parser.add_argument('--image', type=str, help='使用图片水印（水印图片路径）。')
+    parser.add_argument('--font', type=str, choices=list(font_registry.FONT_FAMILIES),
+                        help='水印字体，默认为 Arial。')
+    parser.add_argument('--font_size', type=int, help='水印字体大小，默认为 50。')
+    parser.add_argument('--color', type=str, help='水印颜色，默认为 \'white\'。')
+    parser.add_argument('--opacity', type=int, help='水印不透明度 0-100，默认为 100。')
+    parser.add_argument('--rotation', type=int, help='水印旋转角度。')
+    parser.add_argument('--position', type=str, choices=POSITIONS,
+                        help=f'水印位置，默认为右下角 (bottom_right)；{PATTERN_POSITION} 为平铺整幅图像（按旋转角度倾斜）。')
+    parser.add_argument('--pattern-spacing', type=int, metavar='PX', help='平铺时相邻水印的间距，默认为 100。')
+    parser.add_argument('--pattern-stagger', type=int, metavar='P',
+                        help='平铺时隔行水平错开的百分比 0-100，默认为 50。')
+    parser.add_argument('--recursive', action='store_true', help='递归处理子目录中的图片。')
+    parser.add_argument('--format', type=str, default='same',
+                        choices=['same'] + list(watermark_core.OUTPUT_EXTENSIONS),
+                        help='输出格式，默认与原图相同（AVIF需要带libavif的Pillow）。')
+    parser.add_argument('--quality', type=int, default=95, help='JPEG/WebP/AVIF质量，默认为 95。')
+    parser.add_argument('--profile', type=str, default=watermark_core.DEFAULT_PROFILE,
+                        choices=watermark_core.ENCODER_PROFILES,
+                        help='编码档位：fast编码最快，smallest文件最小，默认为 balanced。')
+    resize = parser.add_mutually_exclusive_group()
+    resize.add_argument('--resize-width', type=int, metavar='PX', help='按宽度缩放输出图片（保持宽高比）。')
+    resize.add_argument('--resize-height', type=int, metavar='PX', help='按高度缩放输出图片（保持宽高比）。')
+    resize.add_argument('--resize-percent', type=float, metavar='P', help='按百分比缩放输出图片。')
+    parser.add_argument('--naming', type=str, default='original', choices=['original', 'prefix', 'suffix'],
+                        help='输出文件命名规则，默认保留原名。')
+    parser.add_argument('--prefix', type=str, default='wm_', help='命名规则为prefix时的前缀。')
+    parser.add_argument('--suffix', type=str, default='_watermarked', help='命名规则为suffix时的后缀。')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='并行度，默认为CPU核数：流水线引擎中为解码/编码线程数，进程引擎中为进程数（为1时顺序处理）。')
+    parser.add_argument('--engine', type=str, default='pipeline', choices=['pipeline', 'process'],
+                        help='导出引擎：pipeline为分阶段线程流水线（默认），process为每张图片一个进程任务。')
+    parser.add_argument('--stage-workers', type=str,
+                        help='流水线各阶段线程数，如 read=4,decode=8,watermark=2,encode=8,write=2。')
+    parser.add_argument('--memory-budget', type=int,
+                        default=tiled_processing.DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+                        help='单张图片的内存预算（MB），超出时对未压缩图像分块处理。')
+    parser.add_argument('--ram-budget', type=int,
+                        help='同时处理的图片的估计内存总量上限（MB），默认为物理内存的一半；超大图像会逐张处理。')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略输出目录中的导出清单，重新导出所有图片。')
+    parser.add_argument('--timing', action='store_true',
+                        help='细分水印阶段的耗时（字体加载、渲染、合成），计入各阶段累计耗时。')
+    parser.add_argument('--json', action='store_true',
+                        help='以JSON Lines格式输出进度和汇总，便于程序解析。')
+    return parser.parse_args(argv)
+
+
+def load_settings(args):
+    """合并默认设置、任务文件和命令行参数"""
+    settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+    if args.spec:
+        with open(args.spec, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+        effects = spec.pop('effects', None) or {}
+        pattern = spec.pop('pattern', None) or {}
+        settings.update(spec)
+        settings['effects'].update(effects)
+        settings['pattern'].update(pattern)
+
+    overrides = {
+        'text': args.text,
+        'font': args.font,
+        'font_size': args.font_size,
+        'color': args.color,
+        'opacity': args.opacity,
+        'rotation': args.rotation,
+        'position': args.position,
+    }
+    settings.update({k: v for k, v in overrides.items() if v is not None})
+    pattern_overrides = {'spacing': args.pattern_spacing, 'stagger': args.pattern_stagger}
+    settings['pattern'].update({k: v for k, v in pattern_overrides.items() if v is not None})
+    if args.image:
+        settings['type'] = 'image'
+        settings['image_path'] = args.image
+    elif args.text:
+        settings['type'] = 'text'
+    return settings
+
+
+def check_inputs(inputs):
+    """检查输入的文件和目录都存在，否则抛出FileNotFoundError"""
+    for item in inputs:
+        if not os.path.isdir(item) and not os.path.isfile(item):
+            raise FileNotFoundError(f"'{item}' 不是有效的文件或目录")
+
+
+def collect_images(inputs, output_dir, recursive):
+    """展开输入的文件和目录，逐批产出[(图片路径, 相对路径)]；扫描时跳过输出目录
+
+    目录按扫描批次产出，调用方拿到第一批即可开始导出，不必等整棵目录树扫描完
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            for batch in scan_images(item, recursive=recursive, skip_dirs=[output_dir]):
+                yield [(path, os.path.relpath(path, item)) for path in batch]
+        else:
+            yield [(item, os.path.basename(item))]
+
+
+def get_resize(args):
+    """命令行中的缩放设置，未指定时返回None；数值无效时抛出ValueError"""
+    for mode in watermark_core.RESIZE_MODES:
+        value = getattr(args, f'resize_{mode}')
+        if value is not None:
+            if value <= 0:
+                raise ValueError(f"--resize-{mode} 必须大于0")
+            return {'mode': mode, 'value': value}
+    return None
+
+
+class JobBuilder:
+    """逐批生成导出任务；记住已分配的输出文件，检查跨批次的输出冲突"""
+
+    def __init__(self, output_dir, settings, args):
+        """输出格式或缩放设置无效时抛出ValueError"""
+        self.output_dir = output_dir
+        self.args = args
+        self.resize = get_resize(args)
+        if args.format != 'same' and args.format not in watermark_core.available_output_formats():
+            raise ValueError(f"当前Pillow不支持输出{args.format}格式")
+        self.spec = WatermarkSpec.compile(settings)  # 所有任务共用同一个编译后的规格
+        self.outputs = {}
+
+    def build(self, images):
+        """返回(任务列表, [(图片路径, 错误信息)])；与之前的输入映射到同一输出文件的图片不生成任务"""
+        args = self.args
+        jobs = []
+        conflicts = []
+        for image_path, rel_path in images:
+            if args.format == 'same':
+                ext = os.path.splitext(image_path)[1].lower()
+                output_format = Image.registered_extensions().get(ext, 'PNG')
+            else:
+                output_format = args.format
+            # 保留子目录结构
+            output_filename = watermark_core.build_output_filename(
+                image_path, args.naming, args.prefix, args.suffix, output_format
+            )
+            if args.format == 'same':
+                output_filename = os.path.splitext(output_filename)[0] + os.path.splitext(image_path)[1]
+            output_path = os.path.join(self.output_dir, os.path.dirname(rel_path), output_filename)
+            key = watermark_core.output_key(output_path)
+            if key in self.outputs:
+                conflicts.append((image_path, f"与 '{self.outputs[key]}' 将输出到同一文件 '{output_path}'"))
+                continue
+            self.outputs[key] = image_path
+            jobs.append({
+                'image_path': image_path,
+                'output_path': output_path,
+                'spec': self.spec,
+                'output_format': output_format,
+                'quality': args.quality,
+                'memory_budget': args.memory_budget * 1024 * 1024,
+                'resize': self.resize,
+                'profile': args.profile
+            })
+        return jobs, conflicts
+
+
+def process_image(job):
+    """处理单张图片（在子进程中运行），返回(状态, 信息, 各阶段耗时, 源文件内容哈希)"""
+    timings = {}
+    os.makedirs(os.path.dirname(job['output_path']) or '.', exist_ok=True)
+    output_path, content_digest = export_manifest.export_job(job, timings)
+    return 'ok', output_path, timings, content_digest
+
+
+def apply_capture_dates(jobs, reporter, index):
+    """未指定水印文本时使用各图片的拍摄日期；EXIF从持久化索引中读取，新图片并行解析"""
+    start = time.perf_counter()
+    dates = index.get_dates([job['image_path'] for job in jobs])
+    reporter.add_timing('exif', time.perf_counter() - start)
+
+    dated = []
+    for job in jobs:
+        date = dates.get(job['image_path'])
+        if date:
+            dated.append(dict(job, spec=job['spec'].with_text(date)))
+        else:
+            reporter.report(job['image_path'], 'skipped', '无法获取水印文本', {})
+    return dated
+
+
+def plan_jobs(batches, builder, reporter, manifest, lock, index=None, force=False):
+    """把扫描批次逐批变成待处理的任务并逐个产出，边扫描边导出
+
+    每批图片生成任务后，按需填入拍摄日期（index不为None时），再对照导出清单跳过未变化的图片；
+    与导出结果的报告和清单记录共用lock
+    """
+    for images in batches:
+        jobs, conflicts = builder.build(images)
+        with lock:
+            reporter.add_total(len(images))
+            for image_path, message in conflicts:
+                reporter.report(image_path, 'failed', message, {})
+            if index is not None and jobs:
+                jobs = apply_capture_dates(jobs, reporter, index)
+            # 对照输出目录中的导出清单，只处理新增或变化的图片；中断后重新运行即可继续
+            if not force:
+                pending = [job for job in jobs if not manifest.is_up_to_date(job)]
+                reporter.plan(len(jobs) - len(pending))
+                jobs = pending
+        yield from jobs
+
+
+class Reporter:
+    """输出进度和汇总：文本格式供人阅读，JSON Lines格式供程序解析"""
+
+    def __init__(self, as_json, profile=None):
+        self.total = 0  # 边扫描边导出，随扫描批次增加
+        self.as_json = as_json
+        self.profile = profile  # 编码档位，与输出字节数和编码耗时一起汇总
+        self.outputs = instrumentation.BatchReport()
+        self.counts = {'ok': 0, 'skipped': 0, 'failed': 0}
+        self.unchanged = 0
+        self.pipeline = None  # 流水线各阶段统计
+        self.stages = {}
+        self.done = 0
+        self.start = time.perf_counter()
+
+    def _emit(self, record, text):
+        if self.as_json:
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+        else:
+            print(text, flush=True)
+
+    def add_timing(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_total(self, count):
+        """扫描到新一批图片"""
+        self.total += count
+
+    def plan(self, unchanged):
+        """报告一批图片中按导出清单未变化而跳过的数量（total、unchanged为截至目前的累计值）"""
+        self.unchanged += unchanged
+        self.done += unchanged
+        self._emit({
+            'event': 'plan',
+            'total': self.total,
+            'unchanged': self.unchanged,
+            'pending': self.total - self.done
+        }, f"已扫描 {self.total} 张图片，{self.unchanged} 张未变化已跳过，待处理 {self.total - self.done} 张")
+
+    def report(self, image_path, status, message, timings):
+        self.done += 1
+        self.counts[status] += 1
+        for stage, seconds in timings.items():
+            self.add_timing(stage, seconds)
+
+        record = {}
+        if status == 'ok':
+            record['bytes'] = os.path.getsize(message)
+            self.outputs.add(timings, record['bytes'], self.profile)
+            text = f"[{self.done}/{self.total}] 已将带水印的图片保存至: {message}"
+        elif status == 'skipped':
+            text = f"[{self.done}/{self.total}] 已跳过 '{image_path}': {message}"
+        else:
+            text = f"[{self.done}/{self.total}] 处理 '{image_path}' 失败: {message}"
+        self._emit({
+            'event': 'progress',
+            'done': self.done,
+            'total': self.total,
+            'image': image_path,
+            'status': status,
+            'message': message,
+            'timings': {k: round(v, 4) for k, v in timings.items()},
+            **record
+        }, text)
+
+    def summary(self, cancelled=False):
+        elapsed = time.perf_counter() - self.start
+        stages = {k: round(v, 4) for k, v in self.stages.items()}
+        stage_text = ", ".join(f"{k} {v:.2f}s" for k, v in stages.items())
+        if self.pipeline:
+            stage_text += "；流水线利用率: " + ", ".join(
+                f"{name} {stats['utilisation']:.0%} x{stats['workers']}" for name, stats in self.pipeline.items())
+        self._emit({
+            'event': 'summary',
+            'total': self.total,
+            'succeeded': self.counts['ok'],
+            'skipped': self.counts['skipped'],
+            'unchanged': self.unchanged,
+            'failed': self.counts['failed'],
+            'cancelled': cancelled,
+            'elapsed': round(elapsed, 4),
+            'stages': stages,
+            'pipeline': self.pipeline,
+            'outputs': self.outputs.outputs_as_dict()
+        }, f"完成: 成功 {self.counts['ok']}，跳过 {self.counts['skipped']}，未变化 {self.unchanged}，失败 {self.counts['failed']}，"
+           f"共 {self.total} 张，耗时 {elapsed:.2f}s（各阶段累计: {stage_text or '无'}；"
+           f"输出: {self.outputs.format_outputs() or '无'}）")
+
+
+def parse_stage_workers(args):
+    """由--jobs和--stage-workers得到流水线各阶段线程数"""
+    workers = export_pipeline.default_stage_workers()
+    workers.update({'decode': args.jobs, 'watermark': max(1, args.jobs // 2), 'encode': args.jobs})
+    if args.stage_workers:
+        for item in args.stage_workers.split(','):
+            name, _, count = item.partition('=')
+            if name.strip() not in export_pipeline.STAGES or not count.strip().isdigit():
+                raise ValueError(f"无效的阶段线程数设置: '{item}'")
+            workers[name.strip()] = max(1, int(count))
+    return workers
+
+
+def run_pipeline(jobs, stage_workers, ram_budget, reporter, manifest, lock):
+    """使用分阶段流水线执行任务（jobs可以是边扫描边产出的迭代器），返回是否被中断"""
+
+    def on_result(job, error, timings, content_digest):
+        with lock:
+            if error is None:
+                manifest.record(job, content_digest)
+                reporter.report(job['image_path'], 'ok', job['output_path'], timings)
+            else:
+                reporter.report(job['image_path'], 'failed', error, timings)
+
+    pipeline = export_pipeline.ExportPipeline(stage_workers, on_result=on_result, ram_budget=ram_budget)
+    try:
+        pipeline.run(jobs)
+    except KeyboardInterrupt:
+        pipeline.cancel()
+        return True
+    finally:
+        reporter.pipeline = pipeline.report()
+    return False
+
+
+def run_jobs(jobs, workers, ram_budget, reporter, manifest, lock):
+    """执行所有任务（jobs可以是边扫描边产出的迭代器）并将成功的任务记入导出清单，返回是否被中断"""
+
+    def finish(job, result):
+        status, message, timings, content_digest = result
+        with lock:
+            if status == 'ok':
+                manifest.record(job, content_digest)
+            reporter.report(job['image_path'], status, message, timings)
+
+    if workers <= 1:
         try:
-            font = ImageFont.truetype("arial.ttf", args.font_size)
-        except IOError:
-            font = ImageFont.load_default()
-
-        bbox = draw.textbbox((0, 0), watermark_text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        x, y = get_position(img.width, img.height, text_width, text_height, args.position)
-
-        draw.text((x, y), watermark_text, fill=args.color, font=font)
-
-        output_dir = os.path.join(image_dir, os.path.basename(image_dir) + "_watermark")
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, image_file)
-        img.save(output_path)
-        print(f"已将带水印的图片保存至: {output_path}")
-
-def get_position(img_width, img_height, text_width, text_height, position):
-    margin = 10
-    if position == 'top_left':
-        return margin, margin
-    elif position == 'top_right':
-        return img_width - text_width - margin, margin
-    elif position == 'bottom_left':
-        return margin, img_height - text_height - margin
-    elif position == 'bottom_right':
-        return img_width - text_width - margin, img_height - text_height - margin
-    elif position == 'center':
-        return (img_width - text_width) / 2, (img_height - text_height) / 2
+            for job in jobs:
+                try:
+                    result = process_image(job)
+                except Exception as e:
+                    result = ('failed', str(e), {}, None)
+                finish(job, result)
+        except KeyboardInterrupt:
+            return True
+        return False
+
+    # 水印图章在父进程中渲染一次并放入共享内存，子进程按句柄映射，不再各自读取和渲染；
+    # 进程池关闭（完成或中断）后释放共享内存
+    with shared_stamps.StampPublisher() as publisher:
+        jobs = (dict(job, spec=publisher.publish(job['spec'])) for job in jobs)
+        return _run_pool(jobs, workers, ram_budget, finish)
+
+
+def _run_pool(jobs, workers, ram_budget, finish):
+    """在进程池中执行任务，每个任务完成后调用finish(job, 结果)，返回是否被中断"""
+    # 按估计的内存占用准入：任务完成后释放预留，下一张图片才提交到进程池
+    gate = memory_scheduler.MemoryGate(ram_budget or memory_scheduler.default_ram_budget())
+    stopped = threading.Event()  # 中断后不再报告仍在运行的任务的结果
+
+    def on_done(future, job, reserved):
+        gate.release(reserved)
+        if future.cancelled() or stopped.is_set():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            result = ('failed', str(e), {}, None)
+        finish(job, result)
+
+    # 父进程中有EXIF读取线程池和边扫描边投放任务的线程，fork可能复制到被其它线程持有的锁而导致子进程死锁，
+    # 与GUI相同统一使用spawn方式启动子进程
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        for job in jobs:
+            try:
+                need = memory_scheduler.estimate_job_memory(job)
+            except Exception:
+                need = 0  # 无法读取文件头，子进程中会报告错误
+            reserved = gate.acquire(need)
+            future = executor.submit(process_image, job)
+            future.add_done_callback(lambda f, job=job, reserved=reserved: on_done(f, job, reserved))
+        executor.shutdown(wait=True)
+    except KeyboardInterrupt:
+        # 提交完成后等待期间的中断同样取消未开始的任务
+        stopped.set()
+        gate.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
+        return True
+    return False
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.timing:
+        instrumentation.set_level(instrumentation.TIMING)
+
+    output_dir = args.output
+    if not output_dir:
+        if len(args.inputs) == 1 and os.path.isdir(args.inputs[0]):
+            image_dir = os.path.normpath(args.inputs[0])
+            output_dir = os.path.join(image_dir, os.path.basename(image_dir) + "_watermark")
+        else:
+            print("错误: 输入不是单个目录时必须使用 -o 指定输出目录。", file=sys.stderr)
+            return 2
+
+    try:
+        settings = load_settings(args)
+        check_inputs(args.inputs)
+        builder = JobBuilder(output_dir, settings, args)
+        stage_workers = parse_stage_workers(args)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+
+    reporter = Reporter(args.json, args.profile)
+    manifest = export_manifest.ExportManifest(output_dir)
+    index = exif_index.ExifIndex() if settings['type'] == 'text' and not settings['text'] else None
+    lock = threading.Lock()
+    # 扫描、生成任务和导出同时进行：第一批图片扫描完即开始导出
+    jobs = plan_jobs(collect_images(args.inputs, output_dir, args.recursive),
+                     builder, reporter, manifest, lock, index, args.force)
+
+    ram_budget = args.ram_budget * 1024 * 1024 if args.ram_budget else None
+    try:
+        if args.engine == 'pipeline':
+            cancelled = run_pipeline(jobs, stage_workers, ram_budget, reporter, manifest, lock)
+        else:
+            cancelled = run_jobs(jobs, max(1, args.jobs), ram_budget, reporter, manifest, lock)
+    finally:
+        if reporter.total:
+            manifest.save()
+        if index is not None:
+            try:
+                index.save()
+            except OSError as e:
+                print(f"Error writing EXIF index: {e}", file=sys.stderr)
+
+    if not reporter.total and not cancelled:
+        print("未找到任何图片文件。", file=sys.stderr)
+        return 1
+    reporter.summary(cancelled)
+    return 1 if cancelled or reporter.counts['failed'] else 0
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    multiprocessing.freeze_support()
+    sys.exit(main())
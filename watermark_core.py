@@ -0,0 +1,446 @@
+import os
+import sys
+import time
+import threading
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageColor
+
+import font_registry
+import instrumentation
+import stamp_cache
+import text_effects
+import tiled_processing
+
+# 水印渲染核心 - 不依赖Qt，可在GUI线程、工作线程和子进程中复用
+
+# 文本尺寸缓存容量（图章本身按内存预算缓存，见stamp_cache）
+STAMP_CACHE_SIZE = 32
+
+# 水印与图像边缘的距离（像素）
+MARGIN = 10
+
+# 发光效果相对于文本的不透明度
+GLOW_OPACITY = 0.6
+
+# 输出格式对应的扩展名
+OUTPUT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'TIFF': '.tif',
+    'BMP': '.bmp',
+    'WEBP': '.webp',
+    'AVIF': '.avif'
+}
+
+# 编码档位：fast编码最快，smallest文件最小，balanced介于两者之间（默认）
+ENCODER_PROFILES = ('fast', 'balanced', 'smallest')
+DEFAULT_PROFILE = 'balanced'
+
+# 各输出格式在各编码档位下传给Image.save()的参数；
+# JPEG的fast和balanced与以前的默认输出逐字节相同（只指定4:2:0色度抽样），smallest另外启用霍夫曼表优化和渐进式编码，解码后的像素与前两者完全相同；
+# PNG的zlib压缩级别对编码耗时影响最大（12MP图片级别1约为级别6的60%，文件大10%左右）；
+# WebP的method和AVIF的speed分别控制编码器的搜索力度
+ENCODER_OPTIONS = {
+    'JPEG': {
+        'fast': {'subsampling': '4:2:0'},
+        'balanced': {'subsampling': '4:2:0'},
+        'smallest': {'subsampling': '4:2:0', 'optimize': True, 'progressive': True}
+    },
+    'PNG': {
+        'fast': {'compress_level': 1},
+        'balanced': {'compress_level': 6},
+        'smallest': {'compress_level': 9, 'optimize': True}
+    },
+    'WEBP': {
+        'fast': {'method': 0},
+        'balanced': {'method': 4},
+        'smallest': {'method': 6}
+    },
+    'AVIF': {
+        'fast': {'speed': 10},
+        'balanced': {'speed': 8},
+        'smallest': {'speed': 6}
+    },
+    'TIFF': {
+        'fast': {},
+        'balanced': {},
+        'smallest': {'compression': 'tiff_adobe_deflate'}
+    }
+}
+
+# 使用质量参数的有损格式
+LOSSY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+
+# 解码后先转换再合成水印的像素模式：合成结果粘贴回调色板、二值或16位整数图像会破坏颜色，
+# 这些图像统一转换为RGB（调色板图像有透明色时为RGBA）
+CONVERTED_MODES = ('P', '1', 'I', 'I;16', 'I;16L', 'I;16B', 'I;16N')
+
+# 各输出格式能保存的像素模式，其它模式在编码前转换为RGB（有透明通道且格式支持时为RGBA）
+OUTPUT_MODES = {
+    'JPEG': ('RGB',),
+    'PNG': ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16'),
+    'TIFF': ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'CMYK', 'I', 'I;16', 'F'),
+    'BMP': ('1', 'L', 'P', 'RGB', 'RGBA'),
+    'WEBP': ('RGB', 'RGBA'),
+    'AVIF': ('RGB', 'RGBA')
+}
+
+# 缩放方式：按宽度、高度（像素）或百分比，保持宽高比
+RESIZE_MODES = ('width', 'height', 'percent')
+
+# JPEG解码时的DCT缩小倍数，与Pillow的draft()一致
+JPEG_DRAFT_SCALES = (8, 4, 2, 1)
+
+# 缩小时先在JPEG解码阶段缩小到不小于目标尺寸的DRAFT_GAP倍（DCT缩放本身带抗锯齿），
+# 再用reduce()整数倍缩小到RESIZE_REDUCING_GAP倍以内，最后做一次LANCZOS重采样；
+# DRAFT_GAP为2时（Image.thumbnail()的默认值）45MP缩小到2048像素宽需要解码和重采样4倍的像素
+DRAFT_GAP = 1.0
+RESIZE_REDUCING_GAP = 3.0
+
+COLOR_MAP = {
+    'white': (255, 255, 255),
+    'black': (0, 0, 0),
+    'red': (255, 0, 0),
+    'blue': (0, 0, 255),
+    'green': (0, 255, 0),
+    'yellow': (255, 255, 0),
+    'cyan': (0, 255, 255),
+    'magenta': (255, 0, 255)
+}
+
+
+def parse_color(color):
+    """将颜色名称/十六进制字符串/RGB(A)元组转换为RGB元组，无法识别时为白色"""
+    if isinstance(color, (tuple, list)) and len(color) >= 3:
+        return tuple(color[:3])
+    if isinstance(color, str):
+        if color.lower() in COLOR_MAP:
+            return COLOR_MAP[color.lower()]
+        elif color.startswith('#'):
+            # 处理十六进制颜色
+            return tuple(int(color[i:i+2], 16) for i in (1, 3, 5))
+        else:
+            try:
+                return ImageColor.getrgb(color)[:3]
+            except:
+                return (255, 255, 255)  # 默认白色
+    return (255, 255, 255)  # 默认白色
+
+
+def get_position(img_width, img_height, wm_width, wm_height, position, margin=MARGIN):
+    """计算水印左上角坐标"""
+    if position == 'top_left':
+        return margin, margin
+    elif position == 'top_center':
+        return (img_width - wm_width) / 2, margin
+    elif position == 'top_right':
+        return img_width - wm_width - margin, margin
+    elif position == 'middle_left':
+        return margin, (img_height - wm_height) / 2
+    elif position == 'center':
+        return (img_width - wm_width) / 2, (img_height - wm_height) / 2
+    elif position == 'middle_right':
+        return img_width - wm_width - margin, (img_height - wm_height) / 2
+    elif position == 'bottom_left':
+        return margin, img_height - wm_height - margin
+    elif position == 'bottom_center':
+        return (img_width - wm_width) / 2, img_height - wm_height - margin
+    else:  # bottom_right
+        return img_width - wm_width - margin, img_height - wm_height - margin
+
+
+def composite_onto(img, layer, x, y):
+    """将水印层合成到img的(x, y)处，只处理两者重叠的区域（原地修改img）
+
+    与创建整幅透明图层再整体alpha_composite的结果逐像素一致，
+    但内存和耗时只与水印面积相关，而与原图面积无关
+    """
+    x, y = int(x), int(y)
+    left, top = max(x, 0), max(y, 0)
+    right = min(x + layer.width, img.width)
+    bottom = min(y + layer.height, img.height)
+    if left >= right or top >= bottom:
+        return
+
+    source = (left - x, top - y, right - x, bottom - y)
+    if img.mode == 'RGBA':
+        img.alpha_composite(layer, (left, top), source)
+    else:
+        # 非RGBA图像只转换重叠区域，合成后粘贴回原图
+        region = img.crop((left, top, right, bottom)).convert('RGBA')
+        region.alpha_composite(layer, (0, 0), source)
+        img.paste(region, (left, top))
+
+
+def _trim(layer, dx, dy):
+    """裁掉图层四周的透明边，返回(图层, 偏移x, 偏移y)；图层全透明时返回None"""
+    box = layer.getbbox()
+    if box is None:
+        return None
+    return layer.crop(box), dx + box[0], dy + box[1]
+
+
+@lru_cache(maxsize=STAMP_CACHE_SIZE)
+def measure_text(text, font_family, font_size):
+    """计算文本尺寸（按参数缓存）"""
+    font = font_registry.get_font(font_family, font_size, text)
+    draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    try:
+        bbox = draw.textbbox((0, 0), text, font=font)
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+    except:
+        # 旧版Pillow兼容
+        return draw.textsize(text, font=font)
+
+
+@stamp_cache.cached
+def get_text_stamp(text, font_family, font_size, rgb_color, opacity, shadow, outline,
+                   rotation=0, frac_x=0.0, frac_y=0.0, glow=False, shadow_blur=0):
+    """渲染文本水印图章（含特效和旋转），按参数缓存，批量处理时只渲染一次
+
+    返回(图层, 偏移x, 偏移y)，文字为空或完全透明时返回None。
+    不旋转时偏移相对于文本位置的整数部分，frac_x/frac_y为位置的小数部分（影响抗锯齿）；
+    旋转时图层为旋转后的紧凑图章，偏移为0，由调用方按图章尺寸计算位置
+    """
+    font = font_registry.get_font(font_family, font_size, text)
+    layer, left, top = text_effects.render_text_effects(
+        text, font, rgb_color + (int(255 * opacity),),
+        shadow_color=(0, 0, 0, int(255 * opacity * 0.5)) if shadow else None,
+        outline_color=(0, 0, 0, int(255 * opacity)) if outline else None,
+        glow_color=rgb_color + (int(255 * opacity * GLOW_OPACITY),) if glow else None,
+        frac_x=frac_x, frac_y=frac_y, shadow_blur=shadow_blur,
+        glow_radius=max(2, font_size / 8)
+    )
+
+    if rotation != 0:
+        # 只旋转文本图层本身，内存占用取决于图章尺寸而与原图尺寸无关
+        rotated = layer.rotate(-rotation, resample=Image.BICUBIC, expand=True, fillcolor=(0, 0, 0, 0))
+        return _trim(rotated, 0, 0)
+
+    return _trim(layer, left, top)
+
+
+def scale_alpha(image, factor):
+    """将RGBA图像的alpha通道乘以factor（原地修改）
+
+    使用查找表对整个alpha通道做一次point()运算，代替逐像素的Python循环
+    """
+    lut = [int(a * factor) for a in range(256)]
+    image.putalpha(image.getchannel('A').point(lut))
+
+
+@stamp_cache.cached
+def get_image_stamp(image_path, stat, scale, opacity, rotation):
+    """加载并渲染图片水印图章（缩放、透明度、旋转），按参数缓存
+
+    stat为水印文件的(大小, 修改时间)，参与缓存键，水印文件被修改后自动重新加载；
+    scale为缩放比例，opacity为0-1
+    """
+    # 打开水印图片
+    watermark = Image.open(image_path).convert("RGBA")
+
+    # 调整水印大小
+    w = int(watermark.width * scale)
+    h = int(watermark.height * scale)
+    watermark = watermark.resize((w, h), Image.LANCZOS)
+
+    # 应用透明度
+    if opacity < 1.0:
+        scale_alpha(watermark, opacity)
+
+    # 应用旋转
+    if rotation != 0:
+        # 使用透明背景进行旋转，确保旋转后的图像保持透明度
+        watermark = watermark.rotate(-rotation, expand=True, resample=Image.BICUBIC, fillcolor=(0, 0, 0, 0))
+
+    # 将水印粘贴到与水印同样大小的透明图层上，使用水印自身作为mask确保透明度正确
+    watermark_layer = Image.new('RGBA', watermark.size, (0, 0, 0, 0))
+    watermark_layer.paste(watermark, (0, 0), watermark)
+    return watermark_layer
+
+
+def build_output_filename(image_path, naming_rule, prefix, suffix, output_format):
+    """根据命名规则和输出格式生成输出文件名"""
+    name = os.path.splitext(os.path.basename(image_path))[0]
+
+    if naming_rule == "original":
+        output_filename = name
+    elif naming_rule == "prefix":
+        output_filename = prefix + name
+    else:
+        output_filename = name + suffix
+
+    # 添加正确的扩展名
+    return output_filename + OUTPUT_EXTENSIONS.get(output_format, ".png")
+
+
+def output_key(output_path):
+    """判断两个任务是否写入同一输出文件时使用的键（绝对路径，Windows上不区分大小写）"""
+    return os.path.normcase(os.path.abspath(output_path))
+
+
+def target_size(width, height, resize):
+    """按缩放设置计算输出尺寸（保持宽高比）；resize为None时返回原尺寸
+
+    resize为{'mode': 'width'|'height'|'percent', 'value': 数值}
+    """
+    if not resize:
+        return width, height
+    mode, value = resize['mode'], resize['value']
+    if mode == 'width':
+        scale = value / width
+    elif mode == 'height':
+        scale = value / height
+    elif mode == 'percent':
+        scale = value / 100
+    else:
+        raise ValueError(f"未知的缩放方式: {mode}")
+    if scale <= 0:
+        raise ValueError(f"无效的缩放值: {value}")
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def draft_size(width, height, image_format, size):
+    """缩小到size时解码得到的尺寸：JPEG在解码时按1/2、1/4、1/8缩小，其它格式解码完整图像"""
+    if image_format != 'JPEG' or size[0] >= width or size[1] >= height:
+        return width, height
+    requested = (max(1, int(size[0] * DRAFT_GAP)), max(1, int(size[1] * DRAFT_GAP)))
+    scale = min(width // requested[0], height // requested[1])
+    for factor in JPEG_DRAFT_SCALES:
+        if scale >= factor:
+            break
+    return -(-width // factor), -(-height // factor)
+
+
+def open_image(fp, resize=None):
+    """打开并解码图像，fp为文件路径或文件对象；指定resize时缩放到目标尺寸
+
+    缩小JPEG时用draft()在解码阶段按DCT缩小，其它格式解码后先用reduce()整数倍缩小，
+    最后做一次高质量重采样，不需要解码和重采样完整分辨率的图像
+    """
+    img = Image.open(fp)
+    size = target_size(img.width, img.height, resize)
+    if size == img.size:
+        img.load()
+        return convert_for_composite(img)
+
+    if size[0] < img.width and size[1] < img.height:
+        img.draft(img.mode, (int(size[0] * DRAFT_GAP), int(size[1] * DRAFT_GAP)))
+    img.load()
+    # 转换后再缩放（调色板图像只能最近邻缩放）
+    img = convert_for_composite(img)
+    return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+
+
+def convert_for_composite(img):
+    """将CONVERTED_MODES中的图像转换为可以合成水印的模式，其它图像原样返回"""
+    if img.mode not in CONVERTED_MODES:
+        return img
+    if img.mode == 'P':
+        return img.convert('RGBA' if img.has_transparency_data else 'RGB')
+    if img.mode == '1':
+        return img.convert('RGB')
+    # 16位整数灰度按16位范围缩放到8位
+    return img.convert('I').point(lambda v: v * (1 / 256)).convert('L').convert('RGB')
+
+
+def available_output_formats():
+    """当前Pillow能够写出的输出格式（AVIF需要带libavif编译的Pillow）"""
+    Image.init()
+    return [fmt for fmt in OUTPUT_EXTENSIONS if fmt in Image.SAVE]
+
+
+def encoder_options(output_format, profile=None, quality=None):
+    """返回按编码档位和质量编码output_format时传给Image.save()的参数"""
+    profile = profile or DEFAULT_PROFILE
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"未知的编码档位: {profile}")
+    options = dict(ENCODER_OPTIONS.get(output_format, {}).get(profile, {}))
+    if quality is not None and output_format in LOSSY_FORMATS:
+        options['quality'] = quality
+    return options
+
+
+def encode_image(img, fp, output_format, quality=None, profile=None):
+    """按输出格式和编码档位编码图像，fp为文件路径或文件对象"""
+    modes = OUTPUT_MODES.get(output_format)
+    if modes is not None and img.mode not in modes:
+        # 如JPEG不支持透明通道、PNG不支持CMYK（可以直接保存的图像无需转换，避免复制整幅图像）
+        img = img.convert("RGBA" if "RGBA" in modes and img.has_transparency_data else "RGB")
+    img.save(fp, format=output_format, **encoder_options(output_format, profile, quality))
+
+
+def write_atomic(output_path, write):
+    """调用write(临时路径)写出文件后替换到output_path，中断时不会留下不完整的输出"""
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def export_tiled(job, timings):
+    """整图处理超出内存预算时分块导出，已导出返回True；不需要或无法分块时返回False
+
+    分块处理只能输出原尺寸，需要缩放的任务总是整图处理（JPEG在解码时即可缩小）
+    """
+    if job.get('resize'):
+        return False
+    start = time.perf_counter()
+    memory_budget = job.get('memory_budget', tiled_processing.DEFAULT_MEMORY_BUDGET)
+    if not tiled_processing.needs_tiling(job['image_path'], memory_budget):
+        return False
+    try:
+        tiled_processing.export_image_tiled(job, memory_budget)
+    except tiled_processing.TilingNotSupported as e:
+        print(f"无法分块处理 {job['image_path']}，改为整图处理: {e}", file=sys.stderr)
+        return False
+    _add_timing(timings, 'tiled', start)
+    return True
+
+
+def export_image(job, timings=None):
+    """导出单张图片：解码、应用水印、编码保存
+
+    job为可pickle的字典，便于分发到子进程：
+    image_path, output_path, spec（WatermarkSpec）, output_format, quality,
+    以及可选的memory_budget（字节，整图处理超出预算时改为分块处理）、
+    resize（缩放设置，见target_size；水印在缩放后应用）和profile（编码档位，见ENCODER_PROFILES）。
+    传入timings字典时累加各阶段耗时（秒）；开启instrumentation计时时还包括水印阶段中的
+    字体加载、渲染和合成耗时
+    """
+    if timings is None:
+        timings = {}
+
+    with instrumentation.collect(timings):
+        return _export_image(job, timings)
+
+
+def _export_image(job, timings):
+    if export_tiled(job, timings):
+        return job['output_path']
+
+    start = time.perf_counter()
+    img = open_image(job['image_path'], job.get('resize'))
+    start = _add_timing(timings, 'decode', start)
+
+    # 应用水印
+    job['spec'].apply(img)
+    start = _add_timing(timings, 'watermark', start)
+
+    # 保存图片
+    write_atomic(job['output_path'],
+                 lambda path: encode_image(img, path, job['output_format'], job['quality'],
+                                           job.get('profile')))
+    _add_timing(timings, 'encode', start)
+
+    return job['output_path']
+
+
+def _add_timing(timings, stage, start):
+    """累加stage阶段自start以来的耗时，返回当前时间作为下一阶段的起点"""
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
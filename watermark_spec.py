@@ -0,0 +1,223 @@
+import hashlib
+import json
+import math
+import os
+from typing import NamedTuple
+
+from PIL import Image
+
+import instrumentation
+import shared_stamps
+import stamp_cache
+import watermark_core
+
+# 编译后的水印规格 - 从GUI设置字典或模板编译一次，颜色、透明度、缩放比例、水印文件状态等全部预先算好；
+# 不可变、可pickle（发送到子进程只需几百字节），预览、单张应用、批量导出和命令行都通过apply()应用水印，
+# 边距、颜色解析和旋转方向在各条路径上保持一致
+
+# 平铺模式：水印按旋转角度渲染一次，与间距组成一个周期单元，单元横向复制成整行图层后逐行合成，
+# 只需渲染一次图章；每行图层按(规格, 图像宽度)缓存，同一批尺寸相同的图片直接复用
+PATTERN_POSITION = 'tile'
+
+
+class WatermarkSpec(NamedTuple):
+    """编译后的水印规格，用WatermarkSpec.compile(settings)创建"""
+
+    kind: str  # 'text' 或 'image'
+    position: str = 'bottom_right'
+    rotation: float = 0  # 顺时针旋转角度
+    opacity: float = 1.0  # 0-1
+    margin: int = watermark_core.MARGIN
+    # 平铺模式（position为PATTERN_POSITION）
+    pattern_spacing: int = 100  # 相邻水印之间的间距（像素）
+    pattern_stagger: float = 0.5  # 隔行水平错开的比例（0-1）
+    # 文本水印
+    text: str = None
+    font_family: str = None
+    font_size: int = 50
+    rgb_color: tuple = (255, 255, 255)
+    shadow: bool = False
+    outline: bool = False
+    glow: bool = False
+    shadow_blur: float = 0
+    # 图片水印
+    image_path: str = ''
+    image_stat: tuple = None  # 水印文件的(大小, 修改时间)，文件变化后图章重新加载；文件不存在时为None
+    image_scale: float = 1.0
+    # 多进程导出时父进程预先渲染并放入共享内存的图章（见shared_stamps），不参与设置哈希
+    sprite: shared_stamps.SpriteHandle = None
+
+    @classmethod
+    def compile(cls, settings):
+        """从设置字典（GUI的watermark_settings或模板JSON）编译水印规格"""
+        effects = settings.get('effects') or {}
+        pattern = settings.get('pattern') or {}
+        common = {
+            'position': settings.get('position', 'bottom_right'),
+            'rotation': settings.get('rotation', 0),
+            'opacity': settings.get('opacity', 100) / 100.0,
+            'pattern_spacing': max(0, int(pattern.get('spacing', 100))),
+            'pattern_stagger': pattern.get('stagger', 50) / 100.0
+        }
+        if settings.get('type', 'text') == 'image':
+            image_path = settings.get('image_path') or ''
+            image_stat = None
+            if image_path and os.path.exists(image_path):
+                stat = os.stat(image_path)
+                image_stat = (stat.st_size, stat.st_mtime_ns)
+            return cls('image', image_path=image_path, image_stat=image_stat,
+                       image_scale=settings.get('image_scale', 100) / 100.0, **common)
+
+        return cls('text', text=settings.get('text'), font_family=settings.get('font'),
+                   font_size=int(settings.get('font_size', 50)),
+                   rgb_color=watermark_core.parse_color(settings.get('color', 'white')),
+                   shadow=bool(effects.get('shadow', False)), outline=bool(effects.get('outline', False)),
+                   glow=bool(effects.get('glow', False)), shadow_blur=effects.get('shadow_blur', 0), **common)
+
+    def with_text(self, text):
+        """替换水印文本（如使用各图片的拍摄日期）"""
+        return self._replace(text=text)
+
+    def digest(self):
+        """规格的哈希，用于导出清单判断设置是否变化"""
+        fields = self._asdict()
+        del fields['sprite']
+        data = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.blake2b(data.encode('utf-8'), digest_size=20).hexdigest()
+
+    def _text_placement(self, img_width, img_height):
+        if not self.text:
+            return None
+        if self.rotation != 0:
+            # 旋转后的图章按其外接框尺寸和所选位置放置
+            layer = self._stamp()
+            if layer is None:
+                return None
+            x, y = watermark_core.get_position(img_width, img_height, layer.width, layer.height,
+                                               self.position, self.margin)
+            return layer, math.floor(x), math.floor(y)
+
+        # 按文本尺寸计算位置，位置的小数部分交给渲染（影响抗锯齿）
+        text_width, text_height = watermark_core.measure_text(self.text, self.font_family, self.font_size)
+        x, y = watermark_core.get_position(img_width, img_height, text_width, text_height,
+                                           self.position, self.margin)
+        anchor_x, anchor_y = math.floor(x), math.floor(y)
+        stamp = watermark_core.get_text_stamp(
+            self.text, self.font_family, self.font_size, self.rgb_color, self.opacity,
+            self.shadow, self.outline, 0, x - anchor_x, y - anchor_y,
+            glow=self.glow, shadow_blur=self.shadow_blur)
+        if stamp is None:
+            return None
+        layer, dx, dy = stamp
+        return layer, anchor_x + dx, anchor_y + dy
+
+    def _image_placement(self, img_width, img_height):
+        layer = self._stamp()
+        if layer is None:
+            return None
+        x, y = watermark_core.get_position(img_width, img_height, layer.width, layer.height,
+                                           self.position, self.margin)
+        return layer, int(x), int(y)
+
+    def _stamp(self):
+        """按旋转角度渲染的水印图章；没有可渲染的内容时返回None
+
+        带共享图章句柄时直接映射共享内存中的图章（平铺模式共享的是整个图案单元）
+        """
+        if self.sprite is not None and self.position != PATTERN_POSITION:
+            return shared_stamps.attach(self.sprite)
+        if self.kind == 'text':
+            if not self.text:
+                return None
+            stamp = watermark_core.get_text_stamp(
+                self.text, self.font_family, self.font_size, self.rgb_color, self.opacity,
+                self.shadow, self.outline, self.rotation, glow=self.glow, shadow_blur=self.shadow_blur)
+            return stamp[0] if stamp is not None else None
+        if self.image_stat is None:
+            return None
+        return watermark_core.get_image_stamp(self.image_path, self.image_stat, self.image_scale,
+                                              self.opacity, self.rotation)
+
+    def shareable_layer(self):
+        """与图像尺寸无关、可以预先渲染后共享给子进程的图层（图章或平铺图案单元）
+
+        不旋转的文字水印的抗锯齿取决于位置的小数部分，随图像尺寸变化，返回None
+        """
+        if self.position == PATTERN_POSITION:
+            return _pattern_cell(self)
+        if self.kind == 'text' and self.rotation == 0:
+            return None
+        return self._stamp()
+
+    def _pattern_placements(self, img_width, img_height):
+        strip = _pattern_strip(self, img_width)
+        if strip is None:
+            return []
+        layer, x, period = strip
+        # 图案在垂直方向居中
+        y = -((period - img_height % period) % period) // 2
+        return [(layer, x, top) for top in range(y, img_height, period)]
+
+    def placements(self, img_width, img_height):
+        """返回需要合成到图像上的所有(图层, x, y)，只依赖图像尺寸而不需要像素数据
+
+        分块处理超大图像时据此只解码与水印重叠的区域；平铺模式下每行图案为一个图层
+        """
+        if self.position == PATTERN_POSITION:
+            return self._pattern_placements(img_width, img_height)
+        if self.kind == 'text':
+            placement = self._text_placement(img_width, img_height)
+        else:
+            placement = self._image_placement(img_width, img_height)
+        return [placement] if placement is not None else []
+
+    def apply(self, image):
+        """将水印合成到图像上（原地修改并返回image）"""
+        with instrumentation.timer('render'):
+            placements = self.placements(image.width, image.height)
+        with instrumentation.timer('composite'):
+            for layer, x, y in placements:
+                watermark_core.composite_onto(image, layer, x, y)
+        return image
+
+
+@stamp_cache.cached
+def _pattern_cell(spec):
+    """平铺图案的周期单元：一行或错开的两行水印，横向首尾相接（图章只渲染一次）
+
+    返回单元图层，没有可渲染的水印时返回None
+    """
+    if spec.sprite is not None:
+        return shared_stamps.attach(spec.sprite)
+    stamp = spec._stamp()
+    if stamp is None:
+        return None
+    gap = spec.pattern_spacing
+    cell_width = stamp.width + gap
+    row_height = stamp.height + gap
+    shift = round(spec.pattern_stagger * cell_width) % cell_width
+    rows = 2 if shift else 1
+
+    cell = Image.new('RGBA', (cell_width, row_height * rows), (0, 0, 0, 0))
+    cell.paste(stamp, (gap // 2, gap // 2))
+    if shift:
+        # 错开的一行超出单元右边界的部分从左边界接续，单元横向复制后图案连续
+        x = (gap // 2 + shift) % cell_width
+        cell.paste(stamp, (x, row_height + gap // 2))
+        if x + stamp.width > cell_width:
+            cell.paste(stamp, (x - cell_width, row_height + gap // 2))
+    return cell
+
+
+@stamp_cache.cached
+def _pattern_strip(spec, img_width):
+    """覆盖整个图像宽度的一行平铺图案，返回(图层, 水平偏移, 行高)；没有可渲染的水印时返回None"""
+    cell = _pattern_cell(spec)
+    if cell is None:
+        return None
+    # 图案在水平方向居中
+    x = -((cell.width - img_width % cell.width) % cell.width) // 2
+    strip = Image.new('RGBA', (img_width - x, cell.height), (0, 0, 0, 0))
+    for left in range(0, strip.width, cell.width):
+        strip.paste(cell, (left, 0))
+    return strip, x, cell.height